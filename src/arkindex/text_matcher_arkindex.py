@@ -2,22 +2,49 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import itertools
+import json
 import logging
 
+import numpy as np
 from apistar.exceptions import ErrorResponse
 from arkindex import ArkindexClient, options_from_env
+from horae_arkindex import client
+from horae_arkindex.character_map import CharacterMap
+from horae_arkindex.journal import Journal
+from horae_arkindex.plan import Plan, ml_class_key
+from horae_sql.database import Database
+from horae_sql.polygons import parse_polygon
+from horae_sql.volume_loader import VolumeLoader
+from horae_text_matcher.disk_cache import DiskTextCache
+from horae_text_matcher.text_cache import PreparedText
 from shapely.geometry import Polygon
-from text_matcher.matcher import Matcher, Text
+from text_matcher.matcher import Matcher
 
 
 class CreateMatchArkindex:
     def __init__(self, args):
         """Initiate the class"""
-        self.cli = ArkindexClient(**options_from_env())
+        # Requests run from a pool of threads, retried on the errors of an overloaded server
+        self.cli = client.ConcurrentClient(
+            lambda: ArkindexClient(**options_from_env()),
+            workers=args.get("workers", client.DEFAULT_WORKERS),
+            rate_limits=client.parse_rate_limits(args.get("rate_limit")),
+            retries=args.get("retries", client.DEFAULT_RETRIES),
+        )
         self.corpus_id = args.get("corpus")
         self.type_element_parent = args.get("type")
+        # Offline mode: matches computed from a SQLite export and saved as a plan
+        self.sql_file = args.get("sql_file")
+        self.plan_path = args.get("plan")
+        self.apply_path = args.get("apply")
+        # Requests already sent, to resume an interrupted run
+        self.journal = Journal(args["journal"]) if args.get("journal") else None
+        # Worker run of the created objects, required by the bulk endpoints
+        self.worker_run_id = args.get("worker_run_id")
         self.entities_classes = []
+        # Text objects of the reference texts, prepared once for all the volumes
+        self.reference_texts = {}
+        self.disk_cache = None if args.get("no_disk_cache") else DiskTextCache()
         logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
 
     @staticmethod
@@ -36,36 +63,16 @@ class CreateMatchArkindex:
 
     def text_matcher(self, volume_transcription):
         """Match volume against text of reference and return position of match"""
-        # Pairs of text to be matched against
-        pairs = list(
-            itertools.product(["volume"], [item[0] for item in self.entities_classes])
-        )
-
-        # Dictionary of texts
-        texts = {"volume": volume_transcription}
-        for row in self.entities_classes:
-            texts[row[0]] = row[2]
+        text_obj_a = PreparedText(self.normalization(volume_transcription), "volume")
 
-        prev_text_objs = {}
         matches = []
-        # Find the match for each pair:
-        for index, pair in enumerate(pairs):
-            filename_a, filename_b = pair[0], pair[1]
-
-            # Put this in a dictionary, so we don't have to process a file twice.
-            for filename in [filename_a, filename_b]:
-                if filename not in prev_text_objs:
-                    prev_text_objs[filename] = Text(
-                        self.normalization(texts[filename]), filename
-                    )
-                    save_text = texts[filename]
-
-            # More convenient naming
-            text_obj_a = prev_text_objs[filename_a]
-            text_obj_b = prev_text_objs[filename_b]
-
-            # Reset the table of previous text objects, so we don't overload memory.
-            prev_text_objs = {filename_a: text_obj_a, filename_b: text_obj_b}
+        # Find the match for each reference text
+        for row in self.entities_classes:
+            entity_id, ref_text = row[0], row[2]
+            # Entities without text, e.g. Beginning and Inside
+            if not ref_text:
+                continue
+            text_obj_b = self.get_reference_text(entity_id, ref_text)
 
             # Do the matching
             pair_match = Matcher(
@@ -83,15 +90,26 @@ class CreateMatchArkindex:
             if pair_match.numMatches > 0:
                 matches.append(
                     [
-                        pair[1],
+                        entity_id,
                         pair_match.locationsA,
                         pair_match.locationsB,
-                        len(save_text),
+                        len(ref_text),
                     ]
                 )
 
         return matches
 
+    def get_reference_text(self, entity_id, ref_text):
+        """Return the text object of a reference text, prepared only once"""
+        if entity_id not in self.reference_texts:
+            text = self.normalization(ref_text)
+            if self.disk_cache:
+                text_obj = self.disk_cache.get(text, entity_id, 7)
+            else:
+                text_obj = PreparedText(text, entity_id)
+            self.reference_texts[entity_id] = text_obj
+        return self.reference_texts[entity_id]
+
     def list_corpus_entities_and_classes(self):
         """List the entity and the class inside the corpus"""
         logging.info("Listing the entities and the classes of the corpus")
@@ -109,19 +127,34 @@ class CreateMatchArkindex:
                 [entity["id"], entity["name"], entity["metas"]["text"], ""]
             )
 
-        # Listing the classes
+        # Add the class_id in EMPTY to complete the link between class and entity
+        for _class in self.list_corpus_classes():
+            for row in self.entities_classes:
+                if _class["name"] == row[1]:
+                    row[3] = _class["id"]
+
+    def list_corpus_classes(self):
+        """List the ML classes of the corpus"""
         try:
-            corpus_classes = self.cli.paginate("ListCorpusMLClasses", id=self.corpus_id)
+            return self.cli.paginate("ListCorpusMLClasses", id=self.corpus_id)
         except ErrorResponse as e:
             logging.error(
                 f"Failed to list classes in corpus {self.corpus_id}: {e.status_code} - {e.content}"
             )
+            return []
 
-        # Add the class_id in EMPTY to complete the link between class and entity
-        for _class in corpus_classes:
-            for row in self.entities_classes:
-                if _class["name"] == row[1]:
-                    row[3] = _class["id"]
+    def list_dump_entities(self, database):
+        """List the entities of a SQLite export, their class is referenced by its name until the plan is applied"""
+        logging.info("Listing the entities of the export")
+        for entity_id, name, metas in database.fetchall("entities"):
+            self.entities_classes.append(
+                [
+                    entity_id,
+                    name,
+                    json.loads(metas or "{}").get("text", ""),
+                    ml_class_key(name),
+                ]
+            )
 
     # get_text_lines_centroid
     def get_text_lines_from_page_id(self, page_id):
@@ -201,67 +234,8 @@ class CreateMatchArkindex:
 
         return digitization_type
 
-    def create_transcription(self, id_page, page_transcription):
-        """Create a transcription for a page"""
-        logging.info("Sending page transcription to Arkindex")
-        body_request = {"text": page_transcription}
-        try:
-            page_transcription = self.cli.request(
-                "CreateTranscription", id=id_page, body=body_request
-            )
-        except ErrorResponse as e:
-            logging.error(
-                f"Failed to create {body_request} on page {id_page}: {e.status_code} - {e.content}."
-            )
-
-        return page_transcription["id"]
-
-    def create_transcription_entity(self, id_transcription, id_entity, offset, length):
-        """Create an element of transcription for a transcription"""
-        logging.info("Create transcription entity")
-        body_request_transcription_entity = {
-            "entity": id_entity,
-            "offset": offset,
-            "length": length,
-        }
-        try:
-            self.cli.request(
-                "CreateTranscriptionEntity",
-                id=id_transcription,
-                body=body_request_transcription_entity,
-            )
-        except ErrorResponse as e:
-            logging.error(
-                f"Failed to create transcription entity {body_request_transcription_entity} in corpus {self.corpus_id}: {e.status_code} - {e.content}."
-            )
-
-    def create_text_segment(self, parent_id, name, polygon, ml_class):
-        logging.info("Create element")
-        body = {
-            "type": "text_segment",
-            "name": name,
-            "corpus": self.corpus_id,
-            "parent": parent_id,
-            "polygon": polygon,
-        }
-        try:
-            response_create_element = self.cli.request(
-                "CreateElement",
-                slim_output=True,
-                body=body,
-            )
-        except ErrorResponse as e:
-            logging.error(
-                f"Failed to create text_segment element {body} in corpus {self.corpus_id}: {e.status_code} - {e.content}."
-            )
-
-        self.create_classification(response_create_element["id"], ml_class)
-
-    def form_transcription_book(self, volume_id):
-        """Form transcription from a book id on Arkindex"""
-        list_page_id_transcription_id = []
-        letter_page_id_offset = []
-        volume_transcription = ""
+    def form_transcription_book(self, volume_id, plan):
+        """Form transcription from a book id on Arkindex, the page transcriptions are added to the plan"""
         logging.info("Forming transcription")
         # Check type of the book
         digitization_type = self.check_type_volume(volume_id)
@@ -278,9 +252,43 @@ class CreateMatchArkindex:
                 f"Failed to list element children in corpus {self.corpus_id}: {e.status_code} - {e.content}."
             )
 
-        for page in volume_pages:
+        # Fetch the text lines of all the pages at the same time
+        page_ids = [page["id"] for page in volume_pages]
+        pages_text_lines = self.cli.map(self.get_text_lines_from_page_id, page_ids)
+
+        return self.form_transcription(
+            zip(page_ids, pages_text_lines), digitization_type, plan
+        )
+
+    def form_transcription_dump(self, volume, plan):
+        """Form transcription from a volume loaded from a SQLite export, see form_transcription_book"""
+        pages = []
+        for page_id, _ in volume.pages:
+            page_text_lines = []
+            for line_id, _, polygon in volume.elements(page_id, "text_line"):
+                points = parse_polygon(polygon)
+                centroid = Polygon(points).centroid
+                for text in volume.texts(line_id):
+                    page_text_lines.append(
+                        # The points of the polygons of Arkindex are integers
+                        [
+                            text,
+                            centroid.x,
+                            centroid.y,
+                            points.astype(int).tolist(),
+                            line_id,
+                        ]
+                    )
+            pages.append((page_id, page_text_lines))
+        return self.form_transcription(pages, volume.digitization_type, plan)
 
-            page_text_lines = self.get_text_lines_from_page_id(page["id"])
+    def form_transcription(self, pages, digitization_type, plan):
+        """Form the transcription of a volume from the (page_id, text lines) of its pages"""
+        list_page_id_transcription_id = []
+        # Page, offset in the page transcription, polygon and id of the text_line of each character
+        character_map = CharacterMap()
+        volume_transcription = ""
+        for page_id, page_text_lines in pages:
             if digitization_type == "double page" and page_text_lines:
                 page_text_lines = self.order_double_page(page_text_lines)
             elif digitization_type == "single page" and page_text_lines:
@@ -291,51 +299,35 @@ class CreateMatchArkindex:
             page_transcription = ""
             for row in page_text_lines:
                 volume_transcription += row[0] + " "
-                for char in list(row[0]):
-                    letter_page_id_offset.append(
-                        [char, page["id"], offset, row[3], row[4]]
-                    )
-                    offset += 1
+                character_map.add_line(page_id, row[3], row[4], len(row[0]), offset)
+                offset += len(row[0])
                 page_transcription += row[0] + "\n"
-                letter_page_id_offset.append(
-                    [" ", page["id"], offset + 1, row[3], row[4]]
-                )
 
             # Create transcription on page
             if page_transcription:
-                id_transcription = self.create_transcription(
-                    page["id"], page_transcription
-                )
+                id_transcription = plan.add_transcription(page_id, page_transcription)
                 # Create a list with relation between transcription id and page id
-                list_page_id_transcription_id.append([page["id"], id_transcription])
+                list_page_id_transcription_id.append([page_id, id_transcription])
         return (
             volume_transcription,
             list_page_id_transcription_id,
-            letter_page_id_offset,
+            character_map,
         )
 
-    def create_classification(self, element_id, ml_class):
-        logging.info("Creating classification")
-        try:
-            self.cli.request(
-                "CreateClassification",
-                body={"element": element_id, "ml_class": ml_class},
-            )
-        except ErrorResponse as e:
-            logging.error(
-                f"Failed to create classification {ml_class} in text_line {element_id}: {e.status_code} - {e.content}."
-            )
-
-    def push_matches_to_arkindex(
-        self, matched_results, list_page_id_transcription_id, letter_page_id_offset
+    def plan_matches(
+        self,
+        matched_results,
+        list_page_id_transcription_id,
+        character_map,
+        plan,
     ):
-        """Push match to Arkindex"""
+        """Add the requests adding the matches to Arkindex to the plan"""
         for match in matched_results:
 
             # Iterate through match inside each reference text
             for intra_match in match[1]:
 
-                offset = letter_page_id_offset[intra_match[0]][2]
+                offset = character_map.offset(intra_match[0])
                 id_entity = match[0]
                 # start_match = intra_match[0]  # Start indicated by text-matcher
                 # end_match = intra_match[1]  # End indicated by text-matcher
@@ -345,18 +337,18 @@ class CreateMatchArkindex:
                 end_approx = (
                     intra_match[1] + match[3] - match[2][0][1]
                 )  # End extended with the info on the text of ref
-                text_line_id = letter_page_id_offset[start_approx][4]
+                text_line_id = character_map.line_id(start_approx)
 
                 # Add class to text_line at the beginning of the match
                 for entity_class in self.entities_classes:
                     if match[0] == entity_class[0]:
                         # Catch the id of the class and add the class to the text_line
                         class_id = entity_class[3]
-                        self.create_classification(text_line_id, class_id)
+                        plan.add_classification(text_line_id, class_id)
 
                     elif "Beginning" in entity_class:
                         # Add Beginning class to text_line
-                        self.create_classification(text_line_id, entity_class[3])
+                        plan.add_classification(text_line_id, entity_class[3])
 
                     elif "Inside" in entity_class:
                         # Catch the id of the Inside class
@@ -365,47 +357,146 @@ class CreateMatchArkindex:
                 # Create entity for the intra match
                 for entity_class in self.entities_classes:
                     if match[0] == entity_class[0]:
-                        self.create_text_segment(
-                            letter_page_id_offset[start_approx][1],
+                        plan.add_text_segment(
+                            character_map.page_id(start_approx),
                             entity_class[1],
-                            letter_page_id_offset[start_approx][3],
+                            character_map.polygon(start_approx),
                             entity_class[3],
                         )
 
                 # Create transcription entity for each intra_match
-                for ind, row in enumerate(
-                    letter_page_id_offset[start_approx:end_approx]
-                ):
+                # Views of the characters of the match, without copy
+                line_indexes = character_map.line_indexes[start_approx:end_approx]
+                offsets = character_map.offsets[start_approx:end_approx]
+                pages = character_map.pages(line_indexes)
+                # Last character of the match on each page, first character of each line
+                page_ends = set(np.flatnonzero(pages[1:] != pages[:-1]).tolist())
+                if len(line_indexes):
+                    page_ends.add(len(line_indexes) - 1)
+                line_starts = np.flatnonzero(line_indexes[1:] != line_indexes[:-1]) + 1
+
+                for ind in sorted(page_ends.union(line_starts.tolist())):
                     if (
-                        start_approx + ind == end_approx - 1
-                        or row[1] != letter_page_id_offset[start_approx + ind + 1][1]
+                        ind in page_ends
                     ):  # Check if the match continue on a different page
+                        page_id = character_map.page_ids[pages[ind]]
                         # Get the id of the transcription on the page
                         id_transcription = [
                             info_trans[1]
                             for info_trans in list_page_id_transcription_id
-                            if row[1] in info_trans[0]
+                            if page_id in info_trans[0]
                         ]
-                        # Push the transcription entity on Arkindex
-                        self.create_transcription_entity(
-                            id_transcription[0],
-                            id_entity,
-                            offset,
-                            row[2] - offset,  # Number of character in the entity
+                        # Number of character in the entity
+                        length = int(offsets[ind]) - offset
+                        plan.add_transcription_entity(
+                            id_transcription[0], id_entity, offset, length
                         )
                         offset = 0
 
                     # Add class in the metadata of the new text_line
-                    if row[4] != text_line_id:
-                        text_line_id = row[4]
+                    line_id = character_map.line_ids[line_indexes[ind]]
+                    if line_id != text_line_id:
+                        text_line_id = line_id
 
                         # Add Beginning class to text_line
-                        self.create_classification(text_line_id, i_class_id)
+                        plan.add_classification(text_line_id, i_class_id)
 
                         # Add the class to the text_line
-                        self.create_classification(text_line_id, class_id)
+                        plan.add_classification(text_line_id, class_id)
+
+    def push_matches_to_arkindex(
+        self,
+        matched_results,
+        list_page_id_transcription_id,
+        character_map,
+        plan,
+        volume_id,
+    ):
+        """Push match to Arkindex"""
+        self.plan_matches(
+            matched_results, list_page_id_transcription_id, character_map, plan
+        )
+        self.apply_plan(plan, volume_id)
+
+    def is_volume_done(self, volume_id):
+        """Whether all the requests of a volume were sent by a previous run"""
+        if self.journal is not None and self.journal.is_done(volume_id):
+            logging.info(f"Volume {volume_id} already sent to Arkindex")
+            return True
+        return False
+
+    def apply_plan(self, plan, volume_id, ids=None):
+        """Send the requests of the plan of a volume to Arkindex
+        With a journal, the requests sent by a previous run are skipped and the volume is done once they all succeeded"""
+        volume_journal = self.journal.start(volume_id) if self.journal else None
+        if volume_journal and volume_journal.sent:
+            logging.info(
+                f"Resuming volume {volume_id}, {len(volume_journal.sent)} requests already sent"
+            )
+        logging.info(f"Sending {len(plan)} requests to Arkindex")
+        failed = plan.apply(self.cli, ids, volume_journal, self.worker_run_id)
+        if failed:
+            logging.error(f"{failed} requests failed")
+        elif self.journal:
+            self.journal.finish(volume_id)
 
     def run(self):
+        if self.apply_path:
+            self.apply_plan_file()
+        elif self.sql_file:
+            self.run_offline()
+        else:
+            self.run_online()
+        self.cli.close()
+        if self.journal:
+            self.journal.close()
+
+    def run_offline(self):
+        """Compute the matches of the volumes of a SQLite export and write the requests to a plan"""
+        with Database(self.sql_file) as database, open(
+            self.plan_path, "w", encoding="utf-8"
+        ) as plan_file:
+            self.list_dump_entities(database)
+            volume_ids = [
+                row[0]
+                for row in database.fetchall(
+                    "elements_by_type", (self.type_element_parent,)
+                )
+            ]
+            loader = VolumeLoader(database)
+            for volume_id in volume_ids:
+                logging.info(f"Matching volume {volume_id}")
+                volume = loader.load([volume_id])[volume_id]
+                plan = Plan(self.corpus_id)
+                (
+                    volume_transcription,
+                    list_page_id_transcription_id,
+                    character_map,
+                ) = self.form_transcription_dump(volume, plan)
+                self.plan_matches(
+                    self.text_matcher(volume_transcription),
+                    list_page_id_transcription_id,
+                    character_map,
+                    plan,
+                )
+                plan.write(plan_file, volume_id)
+        logging.info(f"Plan written to {self.plan_path}")
+
+    def apply_plan_file(self):
+        """Send the requests of a plan written by run_offline"""
+        # The classes of the plan are referenced by their name
+        ids = {
+            ml_class_key(_class["name"]): _class["id"]
+            for _class in self.list_corpus_classes()
+        }
+        with open(self.apply_path, encoding="utf-8") as plan_file:
+            for volume_id, plan in Plan.read(plan_file, self.corpus_id):
+                if self.is_volume_done(volume_id):
+                    continue
+                logging.info(f"Applying the plan of volume {volume_id}")
+                self.apply_plan(plan, volume_id, ids)
+
+    def run_online(self):
         # List all the volume in corpus
         try:
             corpus_volumes = self.cli.paginate(
@@ -419,20 +510,27 @@ class CreateMatchArkindex:
         self.list_corpus_entities_and_classes()
 
         for volume in corpus_volumes:
+            if self.is_volume_done(volume["id"]):
+                continue
+            plan = Plan(self.corpus_id)
 
             # Form the volume transcription
             (
                 volume_transcription,
                 list_page_id_transcription_id,
-                letter_page_id_offset,
-            ) = self.form_transcription_book(volume["id"])
+                character_map,
+            ) = self.form_transcription_book(volume["id"], plan)
 
             # Apply text_matcher
             matched_results = self.text_matcher(volume_transcription)
 
             # Send match to Arkindex
             self.push_matches_to_arkindex(
-                matched_results, list_page_id_transcription_id, letter_page_id_offset
+                matched_results,
+                list_page_id_transcription_id,
+                character_map,
+                plan,
+                volume["id"],
             )
 
 
@@ -455,6 +553,63 @@ def main():
         required=False,
         type=str,
     )
+    parser.add_argument(
+        "-s",
+        "--sql-file",
+        help="SQLite export of the corpus, the matches are computed from it without Arkindex and written to the plan",
+        required=False,
+        type=str,
+    )
+    parser.add_argument(
+        "-p",
+        "--plan",
+        help="JSON lines file where the requests of the matches computed from --sql-file are written",
+        default="arkindex_plan.jsonl",
+        type=str,
+    )
+    parser.add_argument(
+        "--apply",
+        help="Send the requests of a plan written with --sql-file to Arkindex",
+        required=False,
+        type=str,
+    )
+    parser.add_argument(
+        "-j",
+        "--journal",
+        help="SQLite file recording the requests sent by volume, a run with the same journal resumes an interrupted one",
+        required=False,
+        type=str,
+    )
+    parser.add_argument(
+        "--worker-run-id",
+        help="Id of the worker run the created text segments and classifications are attributed to, sent in bulk requests when the server has the bulk endpoints",
+        required=False,
+        type=str,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of requests sent to Arkindex at the same time",
+        default=client.DEFAULT_WORKERS,
+        type=int,
+    )
+    parser.add_argument(
+        "--rate-limit",
+        help="Maximum number of requests by second, for all the operations (e.g. 10) or for one (e.g. CreateElement=5), can be repeated",
+        action="append",
+        type=str,
+    )
+    parser.add_argument(
+        "--retries",
+        help="Number of retries of a request failing with 429, a 5xx status or a connection error",
+        default=client.DEFAULT_RETRIES,
+        type=int,
+    )
+    parser.add_argument(
+        "--no-disk-cache",
+        help="Do not keep the prepared reference texts in ~/.cache/text-reuse",
+        action="store_true",
+    )
 
     args = vars(parser.parse_args())
     CreateMatchArkindex(args).run()
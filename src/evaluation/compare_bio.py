@@ -8,6 +8,7 @@ import os
 from pathlib import Path
 
 import pandas as pd
+from horae_reference_texts.metadata import HeuristMetadata
 
 ARKINDEX_VOLUME_URL = "https://arkindex.teklia.com/element/"
 
@@ -33,6 +34,14 @@ class Compare:
             )
         else:
             raise Exception("Your path to the reference folder do not lead to a folder")
+        # Path of the reference texts by Arkindex id
+        self.reference_paths = {
+            os.path.basename(ref_path).replace(".txt", ""): ref_path
+            for ref_path in self.reference_texts
+        }
+
+        # Read the metadata of the reference texts
+        self.heurist_metadata = HeuristMetadata(heurist_metadata)
 
         # Read the volume metadata
         with open(volume_metadata, "r") as file:
@@ -51,8 +60,8 @@ class Compare:
                         == os.path.basename(second_file).split("_")[-1]
                     ):
                         self.name_output = f"{'_'.join([os.path.basename(second_file).split('_')[1], os.path.basename(second_file).split('_')[-1].replace('.bio', '')])}.html"
-                        self.first_text = self.read_bio(first_file, heurist_metadata)
-                        self.second_text = self.read_bio(second_file, heurist_metadata)
+                        self.first_text = self.read_bio(first_file)
+                        self.second_text = self.read_bio(second_file)
                         self.align_text()
 
             print(f"The files have been generated at {self.output_path}")
@@ -69,13 +78,13 @@ class Compare:
         else:
             print("Both file")
             self.name_output = "output.html"
-            self.first_text = self.read_bio(first_text, heurist_metadata)
-            self.second_text = self.read_bio(second_text, heurist_metadata)
+            self.first_text = self.read_bio(first_text)
+            self.second_text = self.read_bio(second_text)
             self.align_text()
 
             print(f"The file has been generated at {self.output_path}")
 
-    def read_bio(self, bio_file, metadata):
+    def read_bio(self, bio_file):
         """Read a bio file and return a list of [WORD, TAG]"""
         with open(bio_file, "r") as file:
             data_raw = file.readlines()
@@ -118,9 +127,6 @@ class Compare:
             ):
                 list_index.append(["end", index + 1, row["bio_tag"].split("-")[1]])
 
-        with open(metadata, newline="") as meta_file:
-            data = list(csv.reader(meta_file, delimiter=","))
-
         end_tag = "</hov></marka>"
         start_tag = "<marka>"
 
@@ -128,47 +134,47 @@ class Compare:
         #   print(os.path.basename(path).replace('.txt',''))
 
         for row in reversed(list_index):
-            if row[0] == "start" or row[0] == "solo":
-                for data_row in data:
-                    if data_row[1].split()[-1] == row[2]:
-
-                        # Find the reference text for the match
-                        text_ref = ""
-                        for ref_path in self.reference_texts:
-                            if data_row[0] == os.path.basename(ref_path).replace(
-                                ".txt", ""
-                            ):
-                                with open(os.path.join(ref_path), "r") as psalm_file:
-                                    text_ref = psalm_file.read()
-
-                        # Apply the proper marking for a starting match
-                        if row[0] == "start":
-                            word_list.insert(
-                                row[1],
-                                (
-                                    start_tag
-                                    + f'<hov title="{data_row[1]} | Texte : {text_ref}">'
-                                ),
-                            )
-
-                        # Apply the proper marking for a solo match (only one word)
-                        if row[0] == "solo":
-                            word_list.insert(
-                                row[1],
-                                (
-                                    start_tag
-                                    + f'<hov title="{data_row[1]} | Texte : {text_ref}">'
-                                    + end_tag
-                                ),
-                            )
-
-                        # Change the color of the match for a better visibility
-                        if start_tag == "<marka>":
-                            start_tag = "<markb>"
-                            end_tag = "</hov></markb>"
-                        else:
-                            start_tag = "<marka>"
-                            end_tag = "</hov></marka>"
+            if (row[0] == "start" or row[0] == "solo") and (
+                row[2] in self.heurist_metadata.by_tag
+            ):
+                heurist_text = self.heurist_metadata.by_tag[row[2]]
+
+                # Find the reference text for the match
+                text_ref = ""
+                if heurist_text.arkindex_id in self.reference_paths:
+                    with open(
+                        self.reference_paths[heurist_text.arkindex_id], "r"
+                    ) as psalm_file:
+                        text_ref = psalm_file.read()
+
+                # Apply the proper marking for a starting match
+                if row[0] == "start":
+                    word_list.insert(
+                        row[1],
+                        (
+                            start_tag
+                            + f'<hov title="{heurist_text.annotation} | Texte : {text_ref}">'
+                        ),
+                    )
+
+                # Apply the proper marking for a solo match (only one word)
+                if row[0] == "solo":
+                    word_list.insert(
+                        row[1],
+                        (
+                            start_tag
+                            + f'<hov title="{heurist_text.annotation} | Texte : {text_ref}">'
+                            + end_tag
+                        ),
+                    )
+
+                # Change the color of the match for a better visibility
+                if start_tag == "<marka>":
+                    start_tag = "<markb>"
+                    end_tag = "</hov></markb>"
+                else:
+                    start_tag = "<marka>"
+                    end_tag = "</hov></marka>"
 
             # Apply the proper marking for the end ofa match
             elif row[0] == "end":
@@ -7,6 +7,7 @@ import warnings
 from pathlib import Path
 
 import pandas as pd
+from horae_reference_texts.metadata import HeuristMetadata
 from sklearn.metrics import classification_report
 
 warnings.filterwarnings("ignore")
@@ -52,17 +53,10 @@ def evaluation(pred_file, true_file, metadata_heurist, output_path, metadata_vol
     new_df_pred = df_pred[list_columns]
 
     # new column name
-    meta_h = pd.read_csv(metadata_heurist)
-    list_col = meta_h["ID Annotation"].to_numpy()
-    new_name = []
-    for name in list_col:
-        new_name.append(" ".join(name.split()[-6:]))
-
-    list_new_col = []
-    for col in list_columns:
-        for i in new_name:
-            if i.split()[-1] == col:
-                list_new_col.append(i)
+    meta_h = HeuristMetadata(metadata_heurist)
+    list_new_col = [
+        meta_h.by_tag[col].short_name for col in list_columns if col in meta_h.by_tag
+    ]
 
     new_df_true = new_df_true.set_axis(list_new_col, axis="columns")
     new_df_pred = new_df_pred.set_axis(list_new_col, axis="columns")
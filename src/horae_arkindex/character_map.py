@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class CharacterMap:
+    """Text line and offset in its page of each character of the transcription of a volume
+
+    The characters only store the index of their line and their offset in two
+    arrays, the page, polygon and id of a line are stored once in the tables
+    of the lines.
+    """
+
+    def __init__(self):
+        # Tables of the lines
+        self.line_pages = []
+        self.polygons = []
+        self.line_ids = []
+        self.page_ids = []
+        # Arrays of the lines added, concatenated when the characters are accessed
+        self.chunks = []
+        self.arrays = None
+
+    def add_line(self, page_id, polygon, line_id, length, offset):
+        """Add the characters of a line of a page followed by a space, its first character is at the offset
+        The space is at the offset after the following character, as the page transcription ends the line with a newline
+        """
+        if not self.page_ids or self.page_ids[-1] != page_id:
+            self.page_ids.append(page_id)
+        line_index = len(self.line_ids)
+        self.line_pages.append(len(self.page_ids) - 1)
+        self.polygons.append(polygon)
+        self.line_ids.append(line_id)
+
+        offsets = np.arange(offset, offset + length + 1, dtype=np.int32)
+        offsets[-1] += 1
+        self.chunks.append((np.full(length + 1, line_index, dtype=np.int32), offsets))
+        self.arrays = None
+
+    def concatenate(self):
+        if self.arrays is None:
+            self.arrays = (
+                np.concatenate(
+                    [np.empty(0, dtype=np.int32)] + [c[0] for c in self.chunks]
+                ),
+                np.concatenate(
+                    [np.empty(0, dtype=np.int32)] + [c[1] for c in self.chunks]
+                ),
+                np.array(self.line_pages, dtype=np.int32),
+            )
+            # The characters are only kept once
+            self.chunks = [self.arrays[:2]]
+        return self.arrays
+
+    @property
+    def line_indexes(self):
+        """Index of the line of each character"""
+        return self.concatenate()[0]
+
+    @property
+    def offsets(self):
+        """Offset of each character in the transcription of its page"""
+        return self.concatenate()[1]
+
+    def pages(self, line_indexes):
+        """Index of the page of lines in page_ids"""
+        return self.concatenate()[2][line_indexes]
+
+    def __len__(self):
+        return len(self.line_indexes)
+
+    def page_id(self, position):
+        return self.page_ids[self.line_pages[self.line_indexes[position]]]
+
+    def offset(self, position):
+        return int(self.offsets[position])
+
+    def polygon(self, position):
+        return self.polygons[self.line_indexes[position]]
+
+    def line_id(self, position):
+        return self.line_ids[self.line_indexes[position]]
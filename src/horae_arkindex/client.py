@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of requests in flight at the same time
+DEFAULT_WORKERS = 8
+# Number of retries of a request after a failure which may not happen again
+DEFAULT_RETRIES = 5
+# Delay before the first retry in seconds, doubled at each retry
+DEFAULT_BACKOFF = 1.0
+# Status of the responses of a server which is overloaded or failing for a while
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def parse_rate_limits(values):
+    """Return the requests per second by operation of the values "rate" or "Operation=rate",
+    a rate without operation applies to all the operations (key None)"""
+    rate_limits = {}
+    for value in values or []:
+        operation, _, rate = value.rpartition("=")
+        rate_limits[operation or None] = float(rate)
+    return rate_limits
+
+
+def is_transient(error):
+    """Whether a request which failed with this error can be retried"""
+    # apistar ErrorResponse carries the status of the response, the connection
+    # errors and timeouts of requests are OSError
+    return getattr(error, "status_code", None) in RETRY_STATUS or isinstance(
+        error, OSError
+    )
+
+
+class RateLimiter:
+    """Space the calls of the threads to stay under a number of calls per second"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            call = max(now, self.next_call)
+            self.next_call = call + self.interval
+        if call > now:
+            time.sleep(call - now)
+
+
+class ConcurrentClient:
+    """Run the requests of an Arkindex client from a pool of threads
+
+    Each thread has its own client created by make_client, as the sessions of
+    ArkindexClient are not shared between threads. The requests are retried
+    with an exponential backoff on the errors of an overloaded server (429, 5xx)
+    and on connection errors, and the calls of each operation are limited to a
+    number per second with rate_limits, the key None being used for all the
+    operations without their own limit.
+    """
+
+    def __init__(
+        self,
+        make_client,
+        workers=DEFAULT_WORKERS,
+        rate_limits=None,
+        retries=DEFAULT_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+    ):
+        self.make_client = make_client
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limits = rate_limits or {}
+        self.limiters = {}
+        self.limiters_lock = threading.Lock()
+        # Whether the API has an operation, by name
+        self.operations = {}
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="arkindex"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    @property
+    def cli(self):
+        """Client of the current thread"""
+        if not hasattr(self.local, "cli"):
+            self.local.cli = self.make_client()
+        return self.local.cli
+
+    def supports(self, operation):
+        """Whether the API of the server has an operation, e.g. a bulk endpoint"""
+        if operation not in self.operations:
+            try:
+                self.cli.lookup_operation(operation)
+                self.operations[operation] = True
+            except Exception:
+                # apistar raises a ClientError for an operation missing from the schema
+                self.operations[operation] = False
+        return self.operations[operation]
+
+    def limiter(self, operation):
+        """Return the rate limiter of an operation, None without limit"""
+        rate = self.rate_limits.get(operation, self.rate_limits.get(None))
+        if not rate:
+            return None
+        with self.limiters_lock:
+            # Operations without their own limit share the default one
+            key = operation if operation in self.rate_limits else None
+            if key not in self.limiters:
+                self.limiters[key] = RateLimiter(rate)
+            return self.limiters[key]
+
+    def call(self, operation, function):
+        """Call a function running the operation, retry it while it fails with a transient error"""
+        limiter = self.limiter(operation)
+        for retry in range(self.retries + 1):
+            if limiter:
+                limiter.wait()
+            try:
+                return function()
+            except Exception as e:
+                if retry == self.retries or not is_transient(e):
+                    raise
+                delay = self.backoff * 2**retry
+                logging.warning(
+                    f"{operation} failed ({getattr(e, 'status_code', e)}), retry in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+    def request(self, operation, **kwargs):
+        """Run an operation of the API and return its response"""
+        return self.call(operation, lambda: self.cli.request(operation, **kwargs))
+
+    def paginate(self, operation, **kwargs):
+        """Run a paginated operation of the API and return the list of all the results
+        The whole listing is retried as the pages are only fetched while iterating"""
+        return self.call(
+            operation, lambda: list(self.cli.paginate(operation, **kwargs))
+        )
+
+    def submit(self, function, *args, **kwargs):
+        """Run a function calling the client in a thread of the pool, return its future"""
+        return self.executor.submit(function, *args, **kwargs)
+
+    def map(self, function, *iterables):
+        """Run a function on each item in the threads of the pool, return the results in order"""
+        return list(self.executor.map(function, *iterables))
+
+    def starmap(self, function, items):
+        """Run a function on the arguments of each item in the threads of the pool, return the results in order"""
+        return self.map(lambda arguments: function(*arguments), items)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+import time
+
+VOLUME_STARTED = "started"
+VOLUME_DONE = "done"
+
+
+class Journal:
+    """Requests sent to Arkindex by volume and the ids they returned, saved in a SQLite file
+
+    A volume is done once all the requests of its plan succeeded. When a run is
+    interrupted, the next one skips the volumes done and only sends the requests
+    of the other volumes which are not in the journal, with the ids of the objects
+    already created.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # The requests are recorded from the threads of the client
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self.lock = threading.Lock()
+        self.connection.execute("pragma journal_mode = wal;")
+        self.connection.executescript(
+            """
+            create table if not exists volume (id text primary key, status text not null, updated real not null);
+            create table if not exists request (
+                volume_id text not null,
+                request_id text not null,
+                server_id text,
+                created real not null,
+                primary key (volume_id, request_id)
+            );
+            """
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def set_status(self, volume_id, status):
+        with self.lock:
+            self.connection.execute(
+                "insert or replace into volume values (?, ?, ?);",
+                (volume_id, status, time.time()),
+            )
+
+    def is_done(self, volume_id):
+        with self.lock:
+            row = self.connection.execute(
+                "select status from volume where id = ?;", (volume_id,)
+            ).fetchone()
+        return row is not None and row[0] == VOLUME_DONE
+
+    def start(self, volume_id):
+        """Mark a volume as started, return its journal"""
+        self.set_status(volume_id, VOLUME_STARTED)
+        with self.lock:
+            sent = dict(
+                self.connection.execute(
+                    "select request_id, server_id from request where volume_id = ?;",
+                    (volume_id,),
+                )
+            )
+        return VolumeJournal(self, volume_id, sent)
+
+    def finish(self, volume_id):
+        self.set_status(volume_id, VOLUME_DONE)
+
+    def record(self, volume_id, request_id, server_id):
+        with self.lock:
+            self.connection.execute(
+                "insert or replace into request values (?, ?, ?, ?);",
+                (volume_id, request_id, server_id, time.time()),
+            )
+
+
+class VolumeJournal:
+    """Requests of a volume in a journal, see Plan.apply"""
+
+    def __init__(self, journal, volume_id, sent):
+        self.journal = journal
+        self.volume_id = volume_id
+        # Id returned by each request already sent, by request id
+        self.sent = sent
+
+    def record(self, request_id, server_id):
+        self.journal.record(self.volume_id, request_id, server_id)
+        self.sent[request_id] = server_id
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+from collections import defaultdict
+from itertools import groupby
+
+# Bulk endpoints, used with a worker run when the API of the server has them
+BULK_ELEMENTS = "CreateElements"
+BULK_CLASSIFICATIONS = "CreateClassifications"
+# Response of a bulk request rejected by the server, its items are sent one by one
+BULK_REJECTED = object()
+
+
+def ml_class_key(name):
+    """Key of a ML class known by its name, its id is given to Plan.apply"""
+    return f"ml_class:{name}"
+
+
+def request_id(operation):
+    """Id of a request of a plan, the same in all the runs computing the same plan"""
+    return hashlib.sha1(
+        json.dumps(operation, sort_keys=True, ensure_ascii=False).encode()
+    ).hexdigest()
+
+
+def is_key(value):
+    """Whether a value is the key of an object not created yet rather than an Arkindex id"""
+    return isinstance(value, str) and ":" in value
+
+
+class Plan:
+    """Requests to create the page transcriptions, text segments, classifications and transcription entities of a volume
+
+    The requests are only sent by apply. An object is referenced by a key until
+    it is created, e.g. a text segment for its classification, and the identical
+    classifications and transcription entities are only sent once. A plan can be
+    saved as JSON lines, one line by request, to be applied later.
+    """
+
+    def __init__(self, corpus_id):
+        self.corpus_id = corpus_id
+        self.transcriptions = {}
+        self.text_segments = {}
+        # Dicts used as ordered sets
+        self.classifications = {}
+        self.transcription_entities = {}
+
+    def __len__(self):
+        return (
+            len(self.transcriptions)
+            + len(self.text_segments)
+            + len(self.classifications)
+            + len(self.transcription_entities)
+        )
+
+    def add_transcription(self, page_id, text):
+        """Add the transcription of a page, return its key"""
+        key = f"transcription:{page_id}"
+        self.transcriptions[key] = (page_id, text)
+        return key
+
+    def add_classification(self, element_id, ml_class):
+        self.classifications[(element_id, ml_class)] = None
+
+    def add_text_segment(self, parent_id, name, polygon, ml_class):
+        """Add a text_segment and its classification, return the key of the segment"""
+        key = f"text_segment:{len(self.text_segments)}"
+        self.text_segments[key] = (parent_id, name, polygon)
+        self.add_classification(key, ml_class)
+        return key
+
+    def add_transcription_entity(self, transcription_id, entity_id, offset, length):
+        self.transcription_entities[
+            (transcription_id, entity_id, offset, length)
+        ] = None
+
+    def operations(self):
+        """Yield the requests as dicts, in the order they are sent"""
+        for key, (page_id, text) in self.transcriptions.items():
+            yield {
+                "operation": "CreateTranscription",
+                "key": key,
+                "element": page_id,
+                "text": text,
+            }
+        for key, (parent_id, name, polygon) in self.text_segments.items():
+            yield {
+                "operation": "CreateElement",
+                "key": key,
+                "parent": parent_id,
+                "name": name,
+                "polygon": polygon,
+            }
+        for element_id, ml_class in self.classifications:
+            yield {
+                "operation": "CreateClassification",
+                "element": element_id,
+                "ml_class": ml_class,
+            }
+        for transcription_id, entity_id, offset, length in self.transcription_entities:
+            yield {
+                "operation": "CreateTranscriptionEntity",
+                "transcription": transcription_id,
+                "entity": entity_id,
+                "offset": offset,
+                "length": length,
+            }
+
+    def add_operation(self, operation):
+        """Add a request given as a dict by operations"""
+        name = operation["operation"]
+        if name == "CreateTranscription":
+            self.transcriptions[operation["key"]] = (
+                operation["element"],
+                operation["text"],
+            )
+        elif name == "CreateElement":
+            self.text_segments[operation["key"]] = (
+                operation["parent"],
+                operation["name"],
+                operation["polygon"],
+            )
+        elif name == "CreateClassification":
+            self.add_classification(operation["element"], operation["ml_class"])
+        elif name == "CreateTranscriptionEntity":
+            self.add_transcription_entity(
+                operation["transcription"],
+                operation["entity"],
+                operation["offset"],
+                operation["length"],
+            )
+        else:
+            raise ValueError(f"Unknown operation {name}")
+
+    def write(self, file, volume_id):
+        """Write the requests as JSON lines with the id of their volume"""
+        for operation in self.operations():
+            file.write(
+                json.dumps({"volume": volume_id, **operation}, ensure_ascii=False)
+                + "\n"
+            )
+
+    @classmethod
+    def read(cls, file, corpus_id):
+        """Yield the (volume_id, plan) of the JSON lines written by write"""
+        operations = (json.loads(line) for line in file if line.strip())
+        for volume_id, volume_operations in groupby(
+            operations, key=lambda operation: operation["volume"]
+        ):
+            plan = cls(corpus_id)
+            for operation in volume_operations:
+                plan.add_operation(operation)
+            yield volume_id, plan
+
+    def requests(self):
+        """Return the (request id, item) of the transcriptions, text segments, classifications
+        and transcription entities, the id of a request is the hash of its operation"""
+        operations = iter(self.operations())
+        return [
+            [(request_id(next(operations)), item) for item in items]
+            for items in (
+                self.transcriptions,
+                self.text_segments,
+                self.classifications,
+                self.transcription_entities,
+            )
+        ]
+
+    def apply(self, client, ids=None, journal=None, worker_run_id=None):
+        """Send the requests with a ConcurrentClient
+        With a worker run id, the text segments and classifications are created by the bulk endpoints
+        of the server if it has them, they are attributed to the worker run
+        ids gives the Arkindex id of keys not created by the plan, e.g. of the ML classes
+        The requests in the sent dict of a journal are skipped, the others are recorded in it
+        Return the number of failed requests, they are logged"""
+        ids = dict(ids or {})
+        sent = journal.sent if journal else {}
+        record = journal.record if journal else None
+        (
+            transcriptions,
+            text_segments,
+            classifications,
+            transcription_entities,
+        ) = self.requests()
+
+        # Objects created by a previous run
+        for request, key in transcriptions + text_segments:
+            if request in sent:
+                ids[key] = sent[request]
+
+        def pending(requests):
+            return [
+                (request, item) for request, item in requests if request not in sent
+            ]
+
+        failed = self.create_transcriptions(
+            client, pending(transcriptions), ids, record
+        )
+        failed += self.create_text_segments(
+            client, pending(text_segments), ids, record, worker_run_id
+        )
+
+        classifications, skipped = self.resolve(pending(classifications), ids)
+        failed += skipped + self.create_classifications(
+            client, classifications, record, worker_run_id
+        )
+
+        transcription_entities, skipped = self.resolve(
+            pending(transcription_entities), ids
+        )
+        responses = client.starmap(
+            lambda request, entity: self.send(
+                client,
+                "CreateTranscriptionEntity",
+                [request],
+                record,
+                id=entity[0],
+                body={"entity": entity[1], "offset": entity[2], "length": entity[3]},
+            ),
+            transcription_entities,
+        )
+        return failed + skipped + responses.count(None)
+
+    @staticmethod
+    def resolve(requests, ids):
+        """Replace the keys of the (request id, item) by their ids
+        Return the requests and the number of requests skipped as a key has no id, e.g. after a failure"""
+        resolved = [
+            (request, tuple(ids.get(value, value) for value in item))
+            for request, item in requests
+        ]
+        ready = [
+            (request, item) for request, item in resolved if not any(map(is_key, item))
+        ]
+        if len(ready) < len(resolved):
+            logging.warning(
+                f"{len(resolved) - len(ready)} requests skipped, they reference objects which were not created"
+            )
+        return ready, len(resolved) - len(ready)
+
+    @staticmethod
+    def send(client, operation, requests, record, bulk=False, **kwargs):
+        """Send a request for the requests of the plan with these ids, record it in the journal
+        Log its error and return None if it fails, BULK_REJECTED if a bulk request is rejected
+        by the server (4xx) so its items can be sent one by one"""
+        try:
+            response = client.request(operation, **kwargs)
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            content = getattr(e, "content", e)
+            if bulk and status is not None and 400 <= status < 500:
+                logging.warning(
+                    f"{operation} rejected: {status} - {content}, sending its {len(requests)} items one by one."
+                )
+                return BULK_REJECTED
+            logging.error(
+                f"Failed to {operation} {kwargs}: {status or ''} - {content}."
+            )
+            return None
+        if record:
+            # A bulk request returns the created objects in the order of the requests
+            if isinstance(response, list):
+                for request, created in zip(requests, response):
+                    record(request, created.get("id"))
+            else:
+                for request in requests:
+                    record(request, response.get("id"))
+        return response
+
+    def create_transcriptions(self, client, transcriptions, ids, record):
+        """Create the (request id, key) page transcriptions, add their id to ids
+        Return the number of failed requests"""
+        responses = client.starmap(
+            lambda request, key: self.send(
+                client,
+                "CreateTranscription",
+                [request],
+                record,
+                id=self.transcriptions[key][0],
+                body={"text": self.transcriptions[key][1]},
+            ),
+            transcriptions,
+        )
+        ids.update(
+            (key, response["id"])
+            for (_, key), response in zip(transcriptions, responses)
+            if response is not None
+        )
+        return responses.count(None)
+
+    def create_text_segments(
+        self, client, text_segments, ids, record, worker_run_id=None
+    ):
+        """Create the (request id, key) text segments, add their id to ids
+        The bulk endpoint is only used with a worker run, the elements it creates are attributed to it
+        Return the number of failed requests"""
+        failed = 0
+        if worker_run_id and client.supports(BULK_ELEMENTS):
+            # One request by parent
+            by_parent = defaultdict(list)
+            for request, key in text_segments:
+                by_parent[self.text_segments[key][0]].append((request, key))
+            parents = list(by_parent)
+            responses = client.map(
+                lambda parent_id: self.send(
+                    client,
+                    BULK_ELEMENTS,
+                    [request for request, _ in by_parent[parent_id]],
+                    record,
+                    bulk=True,
+                    id=parent_id,
+                    body={
+                        "worker_run_id": worker_run_id,
+                        "elements": [
+                            {
+                                "type": "text_segment",
+                                "name": self.text_segments[key][1],
+                                "polygon": self.text_segments[key][2],
+                            }
+                            for _, key in by_parent[parent_id]
+                        ],
+                    },
+                ),
+                parents,
+            )
+            # The text segments of the rejected requests are created one by one
+            text_segments = []
+            for parent_id, response in zip(parents, responses):
+                if response is BULK_REJECTED:
+                    text_segments += by_parent[parent_id]
+                elif response is None:
+                    failed += len(by_parent[parent_id])
+                else:
+                    ids.update(
+                        (key, element["id"])
+                        for (_, key), element in zip(by_parent[parent_id], response)
+                    )
+
+        responses = client.starmap(
+            lambda request, key: self.send(
+                client,
+                "CreateElement",
+                [request],
+                record,
+                slim_output=True,
+                body={
+                    "type": "text_segment",
+                    "name": self.text_segments[key][1],
+                    "corpus": self.corpus_id,
+                    "parent": self.text_segments[key][0],
+                    "polygon": self.text_segments[key][2],
+                },
+            ),
+            text_segments,
+        )
+        ids.update(
+            (key, response["id"])
+            for (_, key), response in zip(text_segments, responses)
+            if response is not None
+        )
+        return failed + responses.count(None)
+
+    def create_classifications(
+        self, client, classifications, record, worker_run_id=None
+    ):
+        """Create the (request id, (element_id, ml_class)) classifications
+        The bulk endpoint is only used with a worker run, the classifications it creates are attributed to it
+        Return the number of failed requests"""
+        failed = 0
+        if worker_run_id and client.supports(BULK_CLASSIFICATIONS):
+            # One request by element
+            by_element = defaultdict(list)
+            for request, (element_id, ml_class) in classifications:
+                by_element[element_id].append((request, (element_id, ml_class)))
+            elements = list(by_element)
+            responses = client.map(
+                lambda element_id: self.send(
+                    client,
+                    BULK_CLASSIFICATIONS,
+                    [request for request, _ in by_element[element_id]],
+                    record,
+                    bulk=True,
+                    body={
+                        "parent": element_id,
+                        "worker_run_id": worker_run_id,
+                        "classifications": [
+                            {"ml_class": ml_class, "confidence": 1.0}
+                            for _, (_, ml_class) in by_element[element_id]
+                        ],
+                    },
+                ),
+                elements,
+            )
+            # The classifications of the rejected requests are created one by one
+            classifications = []
+            for element_id, response in zip(elements, responses):
+                if response is BULK_REJECTED:
+                    classifications += by_element[element_id]
+                elif response is None:
+                    failed += len(by_element[element_id])
+
+        responses = client.starmap(
+            lambda request, classification: self.send(
+                client,
+                "CreateClassification",
+                [request],
+                record,
+                body={"element": classification[0], "ml_class": classification[1]},
+            ),
+            classifications,
+        )
+        return failed + responses.count(None)
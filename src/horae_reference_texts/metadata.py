@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import csv
+from collections import namedtuple
+
+# A reference text of Heurist:
+# - arkindex_id: id of the entity of the text in Arkindex, also the name of its txt file
+# - annotation: "Incipit | HORAE | Psalm 41 | Psalm | h1005"
+# - name: name of the text ("Psalm 41")
+# - h_tag: tag of the text in the bio files ("h1005")
+# - short_name: end of the annotation used as column name in the evaluation
+HeuristText = namedtuple(
+    "HeuristText", ["arkindex_id", "annotation", "name", "h_tag", "short_name"]
+)
+
+
+class HeuristMetadata:
+    """Metadata of the reference texts exported from Heurist, indexed by Arkindex id and by h-tag"""
+
+    def __init__(self, path):
+        self.by_id = {}
+        self.by_tag = {}
+        with open(path, newline="") as meta_file:
+            for row in csv.DictReader(meta_file, delimiter=","):
+                annotation = row["ID Annotation"]
+                text = HeuristText(
+                    arkindex_id=row["ID Arkindex"],
+                    annotation=annotation,
+                    name=self.get_name(annotation),
+                    h_tag=annotation.split()[-1],
+                    short_name=" ".join(annotation.split()[-6:]),
+                )
+                self.by_id[text.arkindex_id] = text
+                self.by_tag[text.h_tag] = text
+
+    @staticmethod
+    def get_name(annotation):
+        parts = annotation.split("|")
+        return parts[-3] if len(parts) >= 3 else annotation
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def __len__(self):
+        return len(self.by_id)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import sqlite3
+import time
+from collections import Counter
+from pathlib import Path
+
+# Size of the statement cache of the connection, each named query is only parsed once
+CACHED_STATEMENTS = 256
+# Part of the database file read through memory mapping, in bytes
+MMAP_SIZE = 2**30
+# Number of ids bound in a query, below the limit of variables of SQLite
+MAX_IDS_BY_QUERY = 500
+
+# Named queries of the exports, "{ids}" is replaced by one placeholder for each id of a list
+QUERIES = {
+    "volumes": "select id from element where type = 'volume';",
+    "volume_names": "select id, name from element where type = 'volume';",
+    "elements_by_type": "select id from element where type = ?;",
+    "entities": "select id, name, metas from entity;",
+    "digitization_type": "select value from metadata where name = 'Digitization Type' and element_id = ?;",
+    "pages": "select child_id, ordering from element_path where parent_id = ? order by ordering;",
+    "children": "select name, polygon from element where id in (select child_id from element_path where parent_id = ?) and type = ?;",
+    "text_lines": "select text, sel.polygon from transcription inner join (select id, polygon from element where id in (select child_id from element_path where parent_id = ?) and type = 'text_line') as sel on transcription.element_id = sel.id;",
+    "paragraphs": "select text, sel.polygon from transcription inner join (select id, polygon from element where id in (select child_id from element_path where parent_id = ?) and type = 'paragraph' order by polygon) as sel on transcription.element_id = sel.id;",
+    # Loading of volumes, see VolumeLoader
+    "volumes_pages": "select parent_id, child_id, ordering from element_path where parent_id in ({ids}) order by parent_id, ordering;",
+    "volumes_children": """select page.parent_id, child.parent_id, element.id, element.type, element.name, element.polygon
+        from element_path as page
+        inner join element_path as child on child.parent_id = page.child_id
+        inner join element on element.id = child.child_id
+        where page.parent_id in ({ids}) and element.type in ('paragraph', 'text_line', 'text_segment');""",
+    "volumes_transcriptions": """select page.parent_id, transcription.element_id, transcription.text
+        from element_path as page
+        inner join element_path as child on child.parent_id = page.child_id
+        inner join transcription on transcription.element_id = child.child_id
+        where page.parent_id in ({ids})
+        order by transcription.rowid;""",
+    "volumes_digitization_type": "select element_id, value from metadata where name = 'Digitization Type' and element_id in ({ids}) order by rowid;",
+    "volumes_segment_names": """select page.parent_id, element.name
+        from element_path as page
+        inner join element_path as child on child.parent_id = page.child_id
+        inner join element on element.id = child.child_id
+        where page.parent_id in ({ids}) and element.type = 'text_segment' and element.name like ?
+        group by page.parent_id, element.name;""",
+}
+
+# Indexes used by the queries of the exports, as (name, table, columns)
+# The first columns are the ones of the filters, the next ones cover the selected columns
+INDEXES = [
+    ("idx_element_path_parent", "element_path", ("parent_id", "child_id", "ordering")),
+    ("idx_element_path_child", "element_path", ("child_id",)),
+    ("idx_element_type", "element", ("type", "id")),
+    ("idx_transcription_element", "transcription", ("element_id",)),
+    ("idx_metadata_element", "metadata", ("element_id", "name")),
+]
+# Table where the statements run by the preparation are recorded
+PREPARE_LOG_TABLE = "text_reuse_prepare"
+
+
+def list_indexes(cursor, table):
+    """Return the columns of the indexes of a table, by index name"""
+    indexes = {}
+    cursor.execute(f"pragma index_list('{table}');")
+    for index in cursor.fetchall():
+        cursor.execute(f"pragma index_info('{index[1]}');")
+        indexes[index[1]] = tuple(
+            column[2] for column in sorted(cursor.fetchall(), key=lambda c: c[0])
+        )
+    return indexes
+
+
+def prepare_database(connection):
+    """Create the missing indexes used by the exports, run ANALYZE and record the statements in the database
+    An existing index is kept when it starts with the filtered column of the one we need"""
+    cursor = connection.cursor()
+    statements = []
+    for name, table, columns in INDEXES:
+        existing = [
+            index_name
+            for index_name, index_columns in list_indexes(cursor, table).items()
+            if index_columns[:1] == columns[:1]
+        ]
+        if existing:
+            logging.info(
+                f"{table}({columns[0]}) already indexed by {', '.join(existing)}"
+            )
+            continue
+        statements.append(
+            f"create index if not exists {name} on {table} ({', '.join(columns)});"
+        )
+    statements.append("analyze;")
+
+    cursor.execute(
+        f"create table if not exists {PREPARE_LOG_TABLE} (created real not null, statement text not null, duration real not null);"
+    )
+    for statement in statements:
+        start = time.time()
+        cursor.execute(statement)
+        duration = time.time() - start
+        logging.info(f"{statement} ({duration:.2f}s)")
+        cursor.execute(
+            f"insert into {PREPARE_LOG_TABLE} values (?, ?, ?);",
+            (start, statement, duration),
+        )
+    connection.commit()
+    return statements
+
+
+def explain_queries(cursor, queries):
+    """Log the query plan of the (name, sql, parameters) queries, warn on the full scans of a table
+    and on the automatic indexes SQLite builds for each run of a query
+    Return the names of the queries with a full scan or an automatic index"""
+    full_scans = []
+    for name, sql, parameters in queries:
+        cursor.execute(f"explain query plan {sql}", parameters)
+        logging.info(f"Query plan of {name}:")
+        for row in cursor.fetchall():
+            detail = row[-1]
+            if (
+                detail.startswith("SCAN ") and "CONSTANT ROW" not in detail
+            ) or "AUTOMATIC" in detail:
+                logging.warning(f"  {detail}")
+                if name not in full_scans:
+                    full_scans.append(name)
+            else:
+                logging.info(f"  {detail}")
+    return full_scans
+
+
+class Database:
+    """Connection to a sqlite dump running the named queries, with the time spent in each query"""
+
+    def __init__(self, path, read_only=True, queries=QUERIES):
+        self.path = path
+        self.read_only = read_only
+        self.queries = queries
+        self.connection = None
+        # Number of runs and total duration of the queries, by name
+        self.counts = Counter()
+        self.durations = Counter()
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def connect(self):
+        """Open the connection, in read-only mode the database file is never modified"""
+        uri = Path(self.path).resolve().as_uri()
+        if self.read_only:
+            uri += "?mode=ro"
+        self.connection = sqlite3.connect(
+            uri, uri=True, cached_statements=CACHED_STATEMENTS
+        )
+        self.connection.execute(f"pragma mmap_size = {MMAP_SIZE};")
+        self.connection.execute("pragma temp_store = memory;")
+        return self
+
+    def close(self):
+        self.log_timings()
+        self.connection.close()
+
+    def statement(self, name, parameters=(), ids=None):
+        """Return the sql and the parameters of a named query, the ids are bound first"""
+        sql = self.queries[name]
+        if ids is not None:
+            sql = sql.format(ids=", ".join("?" * len(ids)))
+            parameters = [*ids, *parameters]
+        return sql, parameters
+
+    def fetchall(self, name, parameters=(), ids=None):
+        """Run a named query and return all its rows"""
+        start = time.perf_counter()
+        rows = self.connection.execute(
+            *self.statement(name, parameters, ids)
+        ).fetchall()
+        self.counts[name] += 1
+        self.durations[name] += time.perf_counter() - start
+        return rows
+
+    def fetchall_by_ids(self, name, parameters, ids):
+        """Run a named query on the ids by chunks and return all the rows"""
+        rows = []
+        for start in range(0, len(ids), MAX_IDS_BY_QUERY):
+            rows += self.fetchall(
+                name, parameters, ids[start : start + MAX_IDS_BY_QUERY]
+            )
+        return rows
+
+    def fetchone(self, name, parameters=(), ids=None):
+        """Run a named query and return its first row, None without result"""
+        start = time.perf_counter()
+        row = self.connection.execute(*self.statement(name, parameters, ids)).fetchone()
+        self.counts[name] += 1
+        self.durations[name] += time.perf_counter() - start
+        return row
+
+    def explain(self, queries):
+        """Log the query plan of the (name, parameters, ids) queries, see explain_queries"""
+        return explain_queries(
+            self.connection.cursor(),
+            [
+                (name, *self.statement(name, parameters, ids))
+                for name, parameters, ids in queries
+            ],
+        )
+
+    def log_timings(self):
+        """Log the number of runs and the time spent in the queries, the longest first"""
+        for name, duration in self.durations.most_common():
+            logging.info(
+                f"Query {name}: {self.counts[name]} runs in {duration:.2f}s "
+                f"({1000 * duration / self.counts[name]:.2f}ms by run)"
+            )
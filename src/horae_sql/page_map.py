@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import csv
+from bisect import bisect_right
+
+import numpy as np
+
+
+class PageMap:
+    """Page of each character of the text of a volume, stored as the offset where each page starts"""
+
+    def __init__(self, starts, page_ids, length):
+        self.starts = list(starts)
+        self.page_ids = list(page_ids)
+        self.length = length
+
+    @classmethod
+    def from_pages(cls, pages):
+        """Create the map from the (page_id, length of its text) of the pages in the order of the text"""
+        starts, page_ids = [], []
+        length = 0
+        for page_id, page_length in pages:
+            if page_length:
+                starts.append(length)
+                page_ids.append(page_id)
+                length += page_length
+        return cls(starts, page_ids, length)
+
+    @classmethod
+    def from_csv(cls, path):
+        """Read the csv files with a row [letter, page_id] for each character of the text"""
+        pages = []
+        with open(path, newline="") as link_file:
+            for row in csv.reader(link_file, delimiter=","):
+                if pages and pages[-1][0] == row[1]:
+                    pages[-1][1] += 1
+                else:
+                    pages.append([row[1], 1])
+        return cls.from_pages(pages)
+
+    @classmethod
+    def load(cls, path):
+        """Load a map saved as .npz, or a csv file of the previous format"""
+        if not str(path).endswith(".npz"):
+            return cls.from_csv(path)
+        with np.load(path) as data:
+            return cls(
+                data["starts"].tolist(),
+                data["page_ids"].tolist(),
+                int(data["length"]),
+            )
+
+    def save(self, file):
+        """Save the map in the npz format, in a path or a binary file"""
+        np.savez(
+            file,
+            starts=np.array(self.starts, dtype=np.int64),
+            page_ids=np.array(self.page_ids, dtype=str),
+            length=self.length,
+        )
+
+    def page(self, position):
+        """Return the id of the page of the character at a position of the text"""
+        if not 0 <= position < self.length:
+            raise IndexError(f"Position {position} outside of the text")
+        return self.page_ids[bisect_right(self.starts, position) - 1]
+
+    def __len__(self):
+        return self.length
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import ast
+import json
+
+import numpy as np
+from shapely.geometry import Polygon
+
+
+def parse_polygon(polygon):
+    """Return the points of a polygon stored as a list of [x, y] as an array of shape (n, 2)"""
+    if not isinstance(polygon, str):
+        return np.asarray(polygon, dtype=float).reshape(-1, 2)
+    try:
+        points = json.loads(polygon)
+    except ValueError:
+        # Not JSON, e.g. a list of tuples
+        points = ast.literal_eval(polygon)
+    return np.asarray(points, dtype=float).reshape(-1, 2)
+
+
+def parse_polygons(polygons):
+    """Return the points of each polygon, see parse_polygon"""
+    return [parse_polygon(polygon) for polygon in polygons]
+
+
+def concatenate(rings):
+    """Return the points of the rings one after the other, the next point of each one in its ring
+    and the index of the first point of each ring"""
+    lengths = np.array([len(ring) for ring in rings])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    points = np.concatenate(rings)
+    following = np.arange(1, len(points) + 1)
+    # The next point of the last point of a ring is its first point
+    following[starts + lengths - 1] = starts
+    return points, points[following], starts
+
+
+def polygon_centroids(rings):
+    """Return the centroids of the polygons as an array of shape (n, 2), like the centroid of shapely
+    The centroids of all the polygons are computed at once with the shoelace formula"""
+    if not len(rings):
+        return np.empty((0, 2))
+    points, following, starts = concatenate(rings)
+    # Relative to the first point of each ring to keep the precision on large coordinates
+    origins = np.repeat(points[starts], [len(ring) for ring in rings], axis=0)
+    points, following = points - origins, following - origins
+
+    cross = points[:, 0] * following[:, 1] - following[:, 0] * points[:, 1]
+    area = np.add.reduceat(cross, starts)
+    sums = np.add.reduceat((points + following) * cross[:, None], starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        centroids = sums / (3 * area[:, None]) + origins[starts]
+
+    # The polygons without area (points, lines) are left to shapely
+    for index in np.flatnonzero(area == 0):
+        centroid = Polygon(rings[index]).centroid
+        centroids[index] = centroid.x, centroid.y
+    return centroids
+
+
+def polygon_bounds(rings):
+    """Return the bounding boxes (min x, min y, max x, max y) of the polygons as an array of shape (n, 4)"""
+    if not len(rings):
+        return np.empty((0, 4))
+    points, _, starts = concatenate(rings)
+    return np.hstack(
+        [np.minimum.reduceat(points, starts), np.maximum.reduceat(points, starts)]
+    )
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from collections import defaultdict
+
+# Queries of the database loading the volumes
+VOLUME_QUERIES = [
+    "volumes_pages",
+    "volumes_children",
+    "volumes_transcriptions",
+    "volumes_digitization_type",
+]
+# Maximum number of volumes in the parameters of a query
+MAX_VOLUMES_BY_QUERY = 500
+
+
+class Volume:
+    """Elements of a volume loaded from the database, grouped by parent"""
+
+    def __init__(self, volume_id):
+        self.id = volume_id
+        self.digitization_type = None
+        # List of (page_id, ordering) in the order of the pages
+        self.pages = []
+        # (page_id, type) -> list of (id, name, polygon) of the children of the page
+        self.children = defaultdict(list)
+        # Element id -> list of the texts of its transcriptions
+        self.transcriptions = defaultdict(list)
+
+    def elements(self, page_id, element_type):
+        """Return the children of a page with a type, as (id, name, polygon)"""
+        return self.children.get((page_id, element_type), [])
+
+    def texts(self, element_id):
+        """Return the texts of the transcriptions of an element"""
+        return self.transcriptions.get(element_id, [])
+
+
+class VolumeLoader:
+    """Load the pages, their children and the transcriptions of volumes with a few queries"""
+
+    def __init__(self, database):
+        self.database = database
+
+    def load(self, volume_ids=None):
+        """Return the volumes by id, all the volumes of the database if no id is given"""
+        if volume_ids is None:
+            volume_ids = [row[0] for row in self.database.fetchall("volumes")]
+
+        volumes = {volume_id: Volume(volume_id) for volume_id in volume_ids}
+        volume_ids = list(volumes)
+        for start in range(0, len(volume_ids), MAX_VOLUMES_BY_QUERY):
+            self.load_chunk(volumes, volume_ids[start : start + MAX_VOLUMES_BY_QUERY])
+        return volumes
+
+    def load_chunk(self, volumes, volume_ids):
+        for volume_id, page_id, ordering in self.database.fetchall(
+            "volumes_pages", ids=volume_ids
+        ):
+            volumes[volume_id].pages.append((page_id, ordering))
+
+        for (
+            volume_id,
+            page_id,
+            element_id,
+            element_type,
+            name,
+            polygon,
+        ) in self.database.fetchall("volumes_children", ids=volume_ids):
+            volumes[volume_id].children[(page_id, element_type)].append(
+                (element_id, name, polygon)
+            )
+        # Sorted in python, an order by lets SQLite scan the elements in the order of their id
+        for volume_id in volume_ids:
+            for children in volumes[volume_id].children.values():
+                children.sort()
+
+        for volume_id, element_id, text in self.database.fetchall(
+            "volumes_transcriptions", ids=volume_ids
+        ):
+            volumes[volume_id].transcriptions[element_id].append(text)
+
+        for volume_id, value in self.database.fetchall(
+            "volumes_digitization_type", ids=volume_ids
+        ):
+            if volumes[volume_id].digitization_type is None:
+                volumes[volume_id].digitization_type = value
+
+        logging.debug(f"{len(volume_ids)} volumes loaded")
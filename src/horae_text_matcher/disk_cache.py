@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os.path
+import shutil
+import tempfile
+
+import numpy as np
+from horae_text_matcher.ngram_index import CACHE_FOLDER
+from horae_text_matcher.text_cache import PreparedText
+
+# Increase when the format of the entries changes
+CACHE_VERSION = 1
+
+
+def content_hash(text):
+    """Address of a text in the cache"""
+    return hashlib.sha256(f"{CACHE_VERSION}\n{text}".encode()).hexdigest()
+
+
+class DiskTextCache:
+    """Content addressed cache of the texts prepared for the matcher, shared between runs
+
+    Each entry is a folder named after the hash of the text given to the matcher
+    (after normalization) with the prepared text, its tokens and the hashes of
+    its n-grams saved as numpy arrays, which are memory-mapped when loaded.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER):
+        self.folder = os.path.join(folder, "texts")
+
+    def entry_path(self, digest):
+        return os.path.join(self.folder, digest[:2], digest)
+
+    def get(self, text, label, ngrams):
+        """Return the prepared text object of a text, from the cache if possible"""
+        digest = content_hash(text)
+        text_obj = self.load(digest, label)
+        if text_obj is None:
+            text_obj = PreparedText(text, label)
+            text_obj.ngram_hashes(ngrams)
+            self.save(digest, text_obj)
+        elif ngrams not in text_obj.computed_hashes:
+            text_obj.ngram_hashes(ngrams)
+            self.save_hashes(digest, ngrams, text_obj.computed_hashes[ngrams])
+        return text_obj
+
+    def load(self, digest, label):
+        """Load an entry of the cache, return None if it is missing or stale"""
+        path = self.entry_path(digest)
+        try:
+            with open(os.path.join(path, "meta.json")) as meta_file:
+                meta = json.load(meta_file)
+            text = np.load(os.path.join(path, "text.npy"), mmap_mode="r").tobytes()
+            text = text.decode()
+            # Detect an entry written by another version or corrupted
+            if (
+                meta["version"] != CACHE_VERSION
+                or meta["digest"] != digest
+                or meta["text_digest"] != content_hash(text)
+            ):
+                raise ValueError("stale entry")
+            token_ids = np.load(os.path.join(path, "token_ids.npy"), mmap_mode="r")
+            spans = np.load(os.path.join(path, "spans.npy"), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Removing the entry {digest} of the text cache: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        vocabulary = meta["vocabulary"]
+        text_obj = PreparedText.from_tokens(
+            text,
+            label,
+            [vocabulary[token_id] for token_id in token_ids.tolist()],
+            [tuple(span) for span in spans.tolist()],
+        )
+        for name in os.listdir(path):
+            if name.startswith("ngrams_"):
+                ngrams = int(name.replace("ngrams_", "").replace(".npy", ""))
+                text_obj.computed_hashes[ngrams] = np.load(
+                    os.path.join(path, name), mmap_mode="r"
+                )
+        return text_obj
+
+    def save(self, digest, text_obj):
+        """Write an entry of the cache, the entry only appears once completely written"""
+        vocabulary = {}
+        token_ids = np.array(
+            [
+                vocabulary.setdefault(token, len(vocabulary))
+                for token in text_obj.tokens
+            ],
+            dtype=np.uint32,
+        )
+        meta = {
+            "version": CACHE_VERSION,
+            "digest": digest,
+            "text_digest": content_hash(text_obj.text),
+            "vocabulary": list(vocabulary),
+        }
+
+        path = self.entry_path(digest)
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = tempfile.mkdtemp(dir=os.path.dirname(path))
+            np.save(
+                os.path.join(temp_path, "text.npy"),
+                np.frombuffer(text_obj.text.encode(), dtype=np.uint8),
+            )
+            np.save(os.path.join(temp_path, "token_ids.npy"), token_ids)
+            np.save(
+                os.path.join(temp_path, "spans.npy"),
+                np.array(text_obj.spans, dtype=np.int64).reshape(-1, 2),
+            )
+            for ngrams, hashes in text_obj.computed_hashes.items():
+                np.save(os.path.join(temp_path, f"ngrams_{ngrams}.npy"), hashes)
+            with open(os.path.join(temp_path, "meta.json"), "w") as meta_file:
+                json.dump(meta, meta_file)
+            os.rename(temp_path, path)
+        except OSError as e:
+            # Another process may have written the same entry
+            logging.debug(f"Failed to save the entry {digest} of the text cache: {e}")
+            if temp_path:
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+    def save_hashes(self, digest, ngrams, hashes):
+        """Add the hashes of another size of n-grams to an entry"""
+        path = os.path.join(self.entry_path(digest), f"ngrams_{ngrams}.npy")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as hashes_file:
+                np.save(hashes_file, hashes)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.debug(f"Failed to save the n-grams of the entry {digest}: {e}")
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os.path
+import pickle
+from collections import Counter
+
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "text-reuse")
+# Increase when the content of the pickled index changes
+INDEX_VERSION = 1
+
+
+def hash_ngram(ngram):
+    """Return a hash of a n-gram that is stable between runs"""
+    digest = hashlib.blake2b(" ".join(ngram).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def ngram_hashes(text_obj, n):
+    """Return the hashes of the n-grams of a text object, reusing the ones already computed"""
+    if hasattr(text_obj, "ngram_hashes"):
+        return text_obj.ngram_hashes(n).tolist()
+    return [hash_ngram(ngram) for ngram in text_obj.ngrams(n)]
+
+
+def folder_signature(root, paths, ngrams, normalize):
+    """Describe the state of a set of reference files to detect an outdated index"""
+    files = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        files.append((os.path.relpath(path, root), stat.st_mtime_ns, stat.st_size))
+    return (INDEX_VERSION, ngrams, normalize, tuple(files))
+
+
+class NgramIndex:
+    """Inverted index from the n-grams of the reference texts to their positions"""
+
+    def __init__(self, ngrams, signature=None):
+        self.ngrams = ngrams
+        self.signature = signature
+        # Keys of the reference texts, the position in the list is the reference id
+        self.references = []
+        # Hash of the n-gram -> {reference id: [offsets of the n-gram]}
+        self.postings = {}
+
+    def add(self, key, text_obj):
+        """Index the n-grams of a text object"""
+        ref_id = len(self.references)
+        self.references.append(key)
+        for offset, ngram_hash in enumerate(ngram_hashes(text_obj, self.ngrams)):
+            self.postings.setdefault(ngram_hash, {}).setdefault(ref_id, []).append(
+                offset
+            )
+
+    def count_shared(self, text_obj):
+        """Count, for each reference, the n-grams of the text that appear in the reference"""
+        counts = Counter()
+        hashes = Counter(ngram_hashes(text_obj, self.ngrams))
+        for ngram_hash, nb in hashes.items():
+            for ref_id in self.postings.get(ngram_hash, ()):
+                counts[ref_id] += nb
+        return counts
+
+    def candidates(self, text_obj, threshold):
+        """Return the keys of the references sharing at least threshold n-grams with the text
+
+        A match needs a block of more than threshold consecutive common n-grams,
+        so the references left out can't be matched with the text.
+        """
+        return {
+            self.references[ref_id]
+            for ref_id, nb in self.count_shared(text_obj).items()
+            if nb >= threshold
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as index_file:
+            pickle.dump(self, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path, signature):
+        """Load an index from the disk, return None if it is missing or outdated"""
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "rb") as index_file:
+                index = pickle.load(index_file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logging.warning(f"Failed to load the n-gram index {path}: {e}")
+            return None
+        if index.signature != signature:
+            logging.info(f"The n-gram index {path} is outdated")
+            return None
+        return index
+
+    @staticmethod
+    def index_path(root, ngrams, normalize):
+        """Path of the index built for a folder of reference texts"""
+        key = f"{os.path.abspath(root)}|{ngrams}|{normalize}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return os.path.join(CACHE_FOLDER, f"ngram_index_{digest}.pickle")
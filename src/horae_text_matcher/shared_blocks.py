@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from difflib import SequenceMatcher
+
+from text_matcher.matcher import Matcher
+
+
+class SharedBlocksMatcher(Matcher):
+    """Matcher reusing the blocks of common n-grams found for the same pair of texts
+
+    The blocks only depend on the texts and the size of the n-grams, so the
+    matches with another threshold, cutoff or minimal distance are computed
+    from the blocks kept in the dictionary given to the matcher.
+    """
+
+    def __init__(self, textObjA, textObjB, blocks=None, **kwargs):
+        # Set before the matcher looks for the initial matches
+        self.blocks = blocks
+        super().__init__(textObjA, textObjB, **kwargs)
+
+    def get_initial_matches(self):
+        if self.blocks is None:
+            return super().get_initial_matches()
+
+        key = (self.textA.label, self.textB.label, self.ngramSize)
+        if key not in self.blocks:
+            self.blocks[key] = SequenceMatcher(
+                None, self.textAgrams, self.textBgrams
+            ).get_matching_blocks()
+
+        # Only return the matching sequences that are higher than the threshold
+        return [match for match in self.blocks[key] if match.size > self.threshold]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from bisect import bisect_left
+
+from text_matcher.matcher import Matcher
+
+
+def merge_spans(spans):
+    """Merge the overlapping character spans, return them sorted"""
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def count_words_in_spans(space_positions, spans):
+    """Count the spaces of a text inside the character spans of the matches"""
+    return sum(
+        bisect_left(space_positions, end) - bisect_left(space_positions, start)
+        for start, end in merge_spans(spans)
+    )
+
+
+class ReferenceSimilarity:
+    """Number of words of each reference text found in the other reference texts"""
+
+    def __init__(self, ngram_index, threshold, cutoff, ngrams, min_distance):
+        self.ngram_index = ngram_index
+        self.threshold = threshold
+        self.cutoff = cutoff
+        self.ngrams = ngrams
+        self.min_distance = min_distance
+
+        # Keys, text objects and positions of the spaces of the references
+        self.keys = []
+        self.text_objs = []
+        self.space_positions = []
+        self.nb_words = []
+
+    def add(self, key, raw_text, text_obj):
+        """Add a reference, the raw text is the one where the words are counted"""
+        self.keys.append(key)
+        self.text_objs.append(text_obj)
+        self.space_positions.append(
+            [pos for pos, letter in enumerate(raw_text) if letter == " "]
+        )
+        self.nb_words.append(len(raw_text.split()))
+
+    def candidate_pairs(self):
+        """Pairs (i, j) with i < j of the references sharing enough n-grams to match"""
+        positions = {key: i for i, key in enumerate(self.keys)}
+        pairs = set()
+        for i, text_obj in enumerate(self.text_objs):
+            for ref_id, nb in self.ngram_index.count_shared(text_obj).items():
+                j = positions.get(self.ngram_index.references[ref_id])
+                if j is not None and j != i and nb >= self.threshold:
+                    pairs.add((min(i, j), max(i, j)))
+        return sorted(pairs)
+
+    def matrix(self):
+        """Return the matrix of the number of words of the reference i matched in the reference j
+        The diagonal holds the number of words of each reference"""
+        size = len(self.keys)
+        nb_word_tab = [[0] * size for _ in range(size)]
+        for i in range(size):
+            nb_word_tab[i][i] = self.nb_words[i]
+
+        pairs = self.candidate_pairs()
+        logging.info(
+            f"{len(pairs)} pairs to match out of {size * (size - 1) // 2} after n-gram filtering"
+        )
+        # Each pair is only matched once, the locations in both texts fill both cells
+        for i, j in pairs:
+            match = Matcher(
+                self.text_objs[i],
+                self.text_objs[j],
+                threshold=self.threshold,
+                cutoff=self.cutoff,
+                ngramSize=self.ngrams,
+                removeStopwords=False,
+                minDistance=self.min_distance,
+            )
+            match.match()
+            if match.numMatches > 0:
+                nb_word_tab[i][j] = count_words_in_spans(
+                    self.space_positions[i], match.locationsA
+                )
+                nb_word_tab[j][i] = count_words_in_spans(
+                    self.space_positions[j], match.locationsB
+                )
+        return nb_word_tab
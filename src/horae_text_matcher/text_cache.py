@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os.path
+import sys
+from collections import OrderedDict
+
+import numpy as np
+from horae_text_matcher.ngram_index import hash_ngram
+from text_matcher.matcher import Text
+
+
+class PreparedText(Text):
+    """Text object of the matcher that computes each size of n-grams only once"""
+
+    def __init__(self, raw_text, label):
+        self.computed_ngrams = {}
+        self.computed_hashes = {}
+        super().__init__(raw_text, label)
+
+    @classmethod
+    def from_tokens(cls, text, label, tokens, spans):
+        """Rebuild a text object from its tokens, without tokenizing the text again"""
+        text_obj = cls.__new__(cls)
+        text_obj.computed_ngrams = {}
+        text_obj.computed_hashes = {}
+        text_obj.text = text
+        text_obj.label = label
+        text_obj.tokens = tokens
+        text_obj.spans = spans
+        text_obj.length = spans[-1][-1] if spans else 0
+        text_obj.trigrams = text_obj.ngrams(3)
+        return text_obj
+
+    def ngrams(self, n):
+        if n not in self.computed_ngrams:
+            self.computed_ngrams[n] = super().ngrams(n)
+        return self.computed_ngrams[n]
+
+    def ngram_hashes(self, n):
+        """Array of the hashes of the n-grams of the text"""
+        if n not in self.computed_hashes:
+            self.computed_hashes[n] = np.fromiter(
+                (hash_ngram(ngram) for ngram in self.ngrams(n)), dtype=np.uint64
+            )
+        return self.computed_hashes[n]
+
+
+def estimate_size(text_obj):
+    """Approximate the memory used by a text object, in bytes"""
+    size = sys.getsizeof(text_obj.text)
+    size += sys.getsizeof(text_obj.tokens) + sum(
+        sys.getsizeof(token) for token in text_obj.tokens
+    )
+    # Each span is a tuple of two integers
+    size += sys.getsizeof(text_obj.spans) + len(text_obj.spans) * (
+        sys.getsizeof((0, 0)) + 2 * sys.getsizeof(2**40)
+    )
+    # The n-grams are tuples sharing the tokens
+    for ngrams in getattr(text_obj, "computed_ngrams", {}).values():
+        size += sys.getsizeof(ngrams) + len(ngrams) * sys.getsizeof(
+            ngrams[0] if ngrams else ()
+        )
+    for hashes in getattr(text_obj, "computed_hashes", {}).values():
+        size += hashes.nbytes
+    return size
+
+
+class TextCache:
+    """Least recently used cache of the text objects prepared for the matcher"""
+
+    def __init__(self, max_size):
+        # Memory budget of the cache in bytes
+        self.max_size = max_size
+        self.size = 0
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(path, normalize, ngrams):
+        """Identify the text object of a file, a modified file gets a new key"""
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, normalize, ngrams)
+
+    def get(self, key):
+        if key not in self.items:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        return self.items[key][0]
+
+    def put(self, key, text_obj):
+        size = estimate_size(text_obj)
+        if key in self.items:
+            self.size -= self.items.pop(key)[1]
+        self.items[key] = (text_obj, size)
+        self.size += size
+
+        # Evict the least recently used texts, but always keep the last one
+        while self.size > self.max_size and len(self.items) > 1:
+            evicted_key, (_, evicted_size) = self.items.popitem(last=False)
+            self.size -= evicted_size
+            logging.debug(f"Evicting {evicted_key[0]} from the text cache")
+
+    def __len__(self):
+        return len(self.items)
@@ -2,15 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import ast
 import json
 import logging
 import os.path
-import sqlite3
 from collections import namedtuple
 
 from apistar.exceptions import ErrorResponse
 from arkindex import ArkindexClient, options_from_env
+from horae_sql.database import Database, prepare_database
+from horae_sql.polygons import parse_polygon
 from shapely.geometry import Polygon
 
 PageClassification = namedtuple(
@@ -26,41 +26,40 @@ class JsonCreator:
     def __init__(self, args):
         self.cli = ArkindexClient(**options_from_env())
         self.sql_file = args.get("sql_file")
-        self.conn = None
-        self.cursor = None
+        self.database = None
         self.digitization_type = None
         self.output_path = args.get("output_path")
         self.miniature = args.get("miniature")
         self.initial = args.get("initial")
         self.rubrication = args.get("rubrication")
+        # The database is only opened in write mode to create the indexes
+        self.read_only = not args.get("prepare_db")
 
     def __enter__(self):
         """Create a connection to the database"""
-        self.conn = sqlite3.connect(self.sql_file)
-        self.cursor = self.conn.cursor()
+        self.database = Database(self.sql_file, read_only=self.read_only).connect()
         return self
 
     def __exit__(self, *args, **kwargs):
         """Exit the connection of the database"""
-        self.conn.close()
+        self.database.close()
 
     def get_digitization_type(self, id_volume):
         """Set the digitization type"""
-        self.cursor.execute(
-            f"select value from metadata where name = 'Digitization Type' and element_id = '{id_volume}'"
-        )
         # Get the first element of the first list (the only element) of the request
-        self.digitization_type = self.cursor.fetchall()[0][0]
+        self.digitization_type = self.database.fetchall(
+            "digitization_type", (id_volume,)
+        )[0][0]
 
     def text_segment_creation(self, polygon, name_ref):
-        mp = Polygon(ast.literal_eval(str(polygon)))
+        mp = Polygon(parse_polygon(polygon))
         x, y = mp.minimum_rotated_rectangle.exterior.coords.xy
         return TextSegment(
             name_ref, min(x), min(y), (max(x) - min(x)), (max(y) - min(y))
         )
 
     def line_transcription_creation(self, polygon, text):
-        coord = Polygon(ast.literal_eval(str(polygon)))
+        coord = Polygon(parse_polygon(polygon))
         x, y = coord.minimum_rotated_rectangle.exterior.coords.xy
         return LineTranscription(
             text, min(x), min(y), (max(x) - min(x)), (max(y) - min(y))
@@ -85,7 +84,7 @@ class JsonCreator:
         return list_text_lines
 
     def object_creation(self, type, name, polygon):
-        coord = Polygon(ast.literal_eval(str(polygon)))
+        coord = Polygon(parse_polygon(polygon))
         x, y = coord.minimum_rotated_rectangle.exterior.coords.xy
         return AnnotationObject(
             type, name, min(x), min(y), (max(x) - min(x)), (max(y) - min(y))
@@ -93,10 +92,7 @@ class JsonCreator:
 
     def get_info_from_dump(self, id_folder):
         """Return list of namedtuple of PageClassification with id_page, ordering and list_class"""
-        self.cursor.execute(
-            f"select child_id, ordering from element_path where parent_id = '{id_folder}' order by ordering"
-        )
-        list_page_ordering = self.cursor.fetchall()
+        list_page_ordering = self.database.fetchall("pages", (id_folder,))
 
         line_transcriptions = {}
         text_segments = {}
@@ -110,11 +106,8 @@ class JsonCreator:
             ordering = fetched_page[1]
 
             # Get transcription and position on page and save it in a dictionary ordered by page id
-            self.cursor.execute(
-                f"select text, sel.polygon from transcription inner join (select id, polygon from element where id in (select child_id from element_path where parent_id='{id_page}') and type='text_line') as sel on transcription.element_id=sel.id"
-            )
             list_text_lines = []
-            for transcription in self.cursor.fetchall():
+            for transcription in self.database.fetchall("text_lines", (id_page,)):
                 # Giving proper name to variables
                 trans_text = transcription[0]
                 poly_text = transcription[1]
@@ -126,10 +119,7 @@ class JsonCreator:
             # Add initial and rubrication to the list of text line to order them in the list of annotation
             # Fetch the information on initial if asked by the user
             if self.initial:
-                self.cursor.execute(
-                    f"select name, polygon from element where id in (select child_id from element_path where parent_id='{id_page}') and type = 'initial'"
-                )
-                for initial in self.cursor.fetchall():
+                for initial in self.database.fetchall("children", (id_page, "initial")):
                     if initial:
                         # Create Object
                         list_text_lines.append(
@@ -140,10 +130,9 @@ class JsonCreator:
 
             # Fetch the information on rubrication if asked by the user
             if self.rubrication:
-                self.cursor.execute(
-                    f"select name, polygon from element where id in (select child_id from element_path where parent_id='{id_page}') and type='rubrication'"
-                )
-                for rubrication in self.cursor.fetchall():
+                for rubrication in self.database.fetchall(
+                    "children", (id_page, "rubrication")
+                ):
                     if rubrication:
                         # Create Object
                         list_text_lines.append(
@@ -156,11 +145,9 @@ class JsonCreator:
             list_object = []
             # Fetch the information on illustration if asked by the user
             if self.miniature:
-                self.cursor.execute(
-                    f"select name, polygon from element where id in (select child_id from element_path where parent_id='{id_page}') and type = 'illustration'"
-                )
-
-                for illustration in self.cursor.fetchall():
+                for illustration in self.database.fetchall(
+                    "children", (id_page, "illustration")
+                ):
                     if illustration:
                         # Create Object
                         list_object.append(
@@ -187,12 +174,11 @@ class JsonCreator:
             line_transcriptions[id_page] = list_text_lines
 
             # Get text_segment in page and save it in a dictionary ordered by page id
-            self.cursor.execute(
-                f"select name, polygon from element where id in (select child_id from element_path where parent_id='{id_page}') and type='text_segment'"
-            )
             list_text_segments = []
             list_class = []
-            for segment in self.cursor.fetchall():
+            for segment in self.database.fetchall(
+                "children", (id_page, "text_segment")
+            ):
                 list_text_segments.append(
                     self.text_segment_creation(segment[1], segment[0])
                 )
@@ -345,9 +331,26 @@ class JsonCreator:
         with open(os.path.join(self.output_path, f"{id_folder}.json"), "w") as outfile:
             json.dump(manifest, outfile)
 
+    def explain(self):
+        """Log the query plan of the queries of the export, on the first volume and page of the database"""
+        id_volume = (self.database.fetchone("volumes") or [""])[0]
+        id_page = (self.database.fetchone("pages", (id_volume,)) or [""])[0]
+        full_scans = self.database.explain(
+            [
+                ("volumes", (), None),
+                ("digitization_type", (id_volume,), None),
+                ("pages", (id_volume,), None),
+                ("text_lines", (id_page,), None),
+                ("children", (id_page, "text_segment"), None),
+            ]
+        )
+        if full_scans:
+            logging.warning(
+                f"Unindexed queries: {', '.join(full_scans)}, the database can be indexed with --prepare-db"
+            )
+
     def run(self):
-        self.cursor.execute("select id from element where type = 'volume'")
-        id_folder = self.cursor.fetchall()
+        id_folder = self.database.fetchall("volumes")
         for id_row in id_folder:
             try:
                 self.form_formulary(id_row[0])
@@ -399,8 +402,26 @@ def main():
         action="store_true",
     )
 
+    parser.add_argument(
+        "--prepare-db",
+        help="Create the missing indexes used by the export in the sql dump and run ANALYZE before the export",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--explain",
+        help="Log the query plan of the queries of the export before running it",
+        required=False,
+        action="store_true",
+    )
+
     args = vars(parser.parse_args())
+    logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
     with JsonCreator(args) as f:
+        if args["prepare_db"]:
+            prepare_database(f.database.connection)
+        if args["explain"]:
+            f.explain()
         f.run()
 
 
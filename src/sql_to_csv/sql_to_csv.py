@@ -3,14 +3,20 @@
 
 # Importation of the library
 import argparse
-import ast
 import csv
 import logging
 import os.path
-import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+from horae_sql.database import Database, prepare_database
+from horae_sql.page_map import PageMap
+from horae_sql.polygons import parse_polygon, polygon_bounds, polygon_centroids
+from horae_sql.volume_loader import VOLUME_QUERIES, VolumeLoader
 from shapely.geometry import Polygon
 from tqdm import tqdm
 
@@ -41,147 +47,211 @@ HALF_ANNOTATED_VOLUME = [
 ]
 
 EXPORT_TEXT_SEGMENT = "complete_text_segment.csv"
+EXPORT_TEXT_SEGMENT_CORPUS = "50mss_text_segment.csv"
+# Size of the buffer of the text exports, in bytes
+WRITE_BUFFER_SIZE = 2**20
+# Translation of the newlines of the transcriptions into spaces
+NEWLINE_TO_SPACE = str.maketrans("\n", " ")
+
+# Instance of SqlToCsv used by the processes of the pool, with its own connection
+worker_export = None
+
+
+def init_worker(file, output_path):
+    """Open a read-only connection to the database in a process of the pool"""
+    global worker_export
+    worker_export = SqlToCsv(file, output_path).connect()
+
+
+def run_worker(method, book_id, *args):
+    """Export a volume with a method of SqlToCsv inside a process of the pool
+    Return the number of runs and the durations of its queries, logged by the parent process
+    as the connections of the pool are never closed"""
+    getattr(worker_export, method)(book_id, *args)
+    database = worker_export.database
+    counts, durations = database.counts, database.durations
+    database.counts, database.durations = Counter(), Counter()
+    return counts, durations
+
+
+@contextmanager
+def open_atomic(path, mode="w", newline=None, buffering=-1):
+    """Open a temporary file for writing, renamed to the path once it is complete
+    An interrupted export never leaves a partial file, and running it again replaces the file"""
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, mode, buffering, newline=newline) as file:
+            yield file
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
 
 
 class SqlToCsv:
-    def __init__(self, file, output_path):
+    def __init__(self, file, output_path, read_only=True, jobs=1):
         """Initialise the class"""
         self.db_name = file
         self.output_path = output_path
-        self.conn = None
-        self.cursor = None
+        self.read_only = read_only
+        self.jobs = jobs
+        self.database = None
         self.list_book_id = []
         self.list_page_id = []
         self.transcription = []
         self.type_page = ""
+        self.volume = None
         logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.DEBUG)
 
     def __enter__(self):
+        return self.connect()
+
+    def connect(self):
         """Create a connection to the database"""
-        self.conn = sqlite3.connect(self.db_name)
-        self.cursor = self.conn.cursor()
+        self.database = Database(self.db_name, read_only=self.read_only).connect()
         return self
 
     def __exit__(self, *args, **kwargs):
         """Exit the connection of the database"""
-        self.conn.close()
+        self.database.close()
+
+    def explain(self):
+        """Log the query plan of the queries of the exports, on the first book of the database"""
+        volume_id = (self.database.fetchone("volumes") or [""])[0]
+        full_scans = self.database.explain(
+            [
+                ("volumes", (), None),
+                ("volume_names", (), None),
+                *[(name, (), [volume_id]) for name in VOLUME_QUERIES],
+                ("volumes_segment_names", ("%Psalm%",), [volume_id]),
+            ]
+        )
+        if full_scans:
+            logging.warning(
+                f"Unindexed queries: {', '.join(full_scans)}, the database can be indexed with --prepare-db"
+            )
 
     def get_list_book(self):
         """Get and return a list of all the books of the db"""
         logging.info("looking for books in the database")
-        self.cursor.execute('select id from element where type="volume";')
-        self.list_book_id = self.cursor.fetchall()
+        self.list_book_id = self.database.fetchall("volumes")
         logging.info(f"{len(self.list_book_id)} books found")
         return self.list_book_id
 
     def get_list_page(self, book_id):
         """Get and return the list of all the page of a book"""
         logging.info(f"looking for pages in book {book_id}")
-        self.cursor.execute(
-            f"select child_id, ordering from element_path where parent_id = '{book_id}' order by ordering;"
-        )
-        self.list_page_id = self.cursor.fetchall()
+        self.list_page_id = self.database.fetchall("pages", (book_id,))
         logging.info(f"{len(self.list_page_id)} pages found")
         return self.list_page_id
 
+    def load_volume(self, book_id):
+        """Load the pages, the elements and the transcriptions of a book with a few queries"""
+        if self.volume is None or self.volume.id != book_id:
+            logging.info(f"loading the elements of book {book_id}")
+            self.volume = VolumeLoader(self.database).load([book_id])[book_id]
+        self.list_page_id = self.volume.pages
+        self.type_page = self.volume.digitization_type
+        return self.volume
+
+    def get_page_elements(self, page_id, element_type, columns):
+        """Get the children of a page with a type as a dataframe with columns among id, name and polygon"""
+        return pd.DataFrame(
+            data=[
+                [dict(zip(["id", "name", "polygon"], element))[c] for c in columns]
+                for element in self.volume.elements(page_id, element_type)
+            ],
+            columns=columns,
+        )
+
     def get_transcription_from_pageid_with_paragraph(self, page_id):
         """Get and return the transcription for simple page"""
-        self.cursor.execute(
-            f"select text from transcription where element_id in (select id from element where id in ("
-            f"select child_id from element_path where parent_id='{page_id}')and type='paragraph' order by polygon)"
+        # Order the paragraphs by polygon, a missing polygon first like in sql
+        paragraphs = sorted(
+            self.volume.elements(page_id, "paragraph"),
+            key=lambda paragraph: (paragraph[2] is not None, paragraph[2] or ""),
+        )
+        return self.join_transcriptions(
+            text
+            for paragraph_id, _, _ in paragraphs
+            for text in self.volume.texts(paragraph_id)
         )
-        df = pd.DataFrame(self.cursor.fetchall(), columns=["text"])
-        return self.get_transcription_df_single_page_para(df)
 
     def get_transcription_double_page(self, page_id):
         """Get the transcription on a double page with the paragraph in order"""
-        self.cursor.execute(
-            f"select text, sel.polygon from transcription inner join (select id, polygon from element where id in (select child_id from element_path where parent_id='{page_id}')and type='paragraph' order by polygon) as sel on transcription.element_id=sel.id"
+        df = pd.DataFrame(
+            self.database.fetchall("paragraphs", (page_id,)),
+            columns=["text", "polygon"],
         )
-        df = pd.DataFrame(self.cursor.fetchall(), columns=["text", "polygon"])
 
         return self.get_transcription_double_page_df_para(df)
 
+    @staticmethod
+    def join_transcriptions(texts):
+        """Join the texts, each one followed by a space, with their newlines replaced by spaces"""
+        return "".join(f"{text} " for text in texts).translate(NEWLINE_TO_SPACE)
+
     @staticmethod
     def get_transcription_df_single_page_para(df):
         """Extract the transcription for single page"""
-        transcription = ""
-        for index, row in df.iterrows():
-            transcription += row["text"] + " "
-        transcription = [phrase[0].replace("\n", " ") for phrase in transcription]
-        return "".join(transcription)
+        return SqlToCsv.join_transcriptions(df["text"])
 
     @staticmethod
     def get_transcription_double_page_df_para(df):
         """Extract the transcription for double page"""
-        df["polygon"] = df.polygon.apply(lambda x: Polygon(ast.literal_eval(str(x))))
-        df["x_axis"] = df.polygon.apply(lambda a: a.centroid.x)  # order on which page
-        df["y_axis"] = df.polygon.apply(
-            lambda a: a.centroid.y
-        )  # order where on the page
-        transcription = ""
+        centroids = polygon_centroids(df.polygon.apply(parse_polygon).tolist())
+        df["x_axis"] = centroids[:, 0]  # order on which page
+        df["y_axis"] = centroids[:, 1]  # order where on the page
 
         # Check if the dataframe is empty else return empty string
-        if len(df.index) != 0:
-            # Create a limit between the pages
-            df = df.sort_values(by=["y_axis"])
-            stat = df["x_axis"].describe()
-            x_limit = (stat[4] + stat[7]) / 2
-
-            # Get the transcription
-            for i in [0, 1]:
-                for index, row in df.iterrows():
-                    if i == 0 and row["x_axis"] < x_limit:
-                        transcription += row["text"] + " "
-                    if i == 1 and row["x_axis"] > x_limit:
-                        transcription += row["text"] + " "
-            transcription = [phrase[0].replace("\n", " ") for phrase in transcription]
-        return "".join(transcription)
+        if len(df.index) == 0:
+            return ""
+
+        # Create a limit between the pages
+        df = df.sort_values(by=["y_axis"])
+        stat = df["x_axis"].describe()
+        x_limit = (stat[4] + stat[7]) / 2
+
+        # Get the transcription of the left page then of the right page
+        return SqlToCsv.join_transcriptions(
+            [*df["text"][df["x_axis"] < x_limit], *df["text"][df["x_axis"] > x_limit]]
+        )
 
     def check_type_page_from_book_id_complete(self, book_id):
         """Check the type of the page to apply the right get_transcription algorithm for the complete corpus"""
-        self.cursor.execute(
-            f"select value from metadata where name = 'Digitization Type' and element_id = '{book_id}'"
-        )
-        self.type_page = self.cursor.fetchall()[0][0]
+        self.type_page = self.database.fetchall("digitization_type", (book_id,))[0][0]
+
+    def iter_page_transcriptions(self, book_id):
+        """Yield the (page_id, transcription) of the pages of a book from complete corpus
+        The elements and transcriptions of the whole book are loaded first, only the texts are built page by page"""
+        self.load_volume(book_id)
+        if self.type_page not in ("single page", "double page"):
+            logging.info("The Digitization type is not regular")
+            return
+
+        for page_id in self.list_page_id:
+            yield page_id[0], self.get_transcription_from_pageid_with_paragraph(
+                page_id[0]
+            )
 
     def save_book_complete_para(self, book_id):
-        """Save book from complete corpus"""
-        list_word_id_page = []
-        with open(os.path.join(self.output_path, f"para_{book_id}.txt"), "w") as file:
-            self.list_page_id = self.get_list_page(book_id)
-            self.check_type_page_from_book_id_complete(book_id)
-
-            # Extraction for single paged book
-            if self.type_page == "single page":
-                for page_id in self.list_page_id:
-                    trans = self.get_transcription_from_pageid_with_paragraph(
-                        page_id[0]
-                    )
-                    file.write(trans)
-                    if trans:
-                        for letter in trans:
-                            list_word_id_page.append([letter, page_id[0]])
-
-            # Extraction for double paged book
-            elif self.type_page == "double page":
-                for page_id in self.list_page_id:
-                    trans = self.get_transcription_from_pageid_with_paragraph(
-                        page_id[0]
-                    )
-                    file.write(trans)
-                    if trans:
-                        for letter in trans:
-                            list_word_id_page.append([letter, page_id[0]])
-
-            else:
-                logging.info("The Digitization type is not regular")
-
-            with open(
-                os.path.join(self.output_path, f"idpage_{book_id}.txt"), "w", newline=""
-            ) as f:
-                writer = csv.writer(f)
-                writer.writerows(list_word_id_page)
+        """Save book from complete corpus
+        The memory used is bounded by the loaded book, the text is written page by page"""
+        # Length of the text of each page
+        list_page_length = []
+        with open_atomic(
+            os.path.join(self.output_path, f"para_{book_id}.txt"),
+            buffering=WRITE_BUFFER_SIZE,
+        ) as file:
+            for page_id, trans in self.iter_page_transcriptions(book_id):
+                file.write(trans)
+                list_page_length.append((page_id, len(trans)))
+
+        # Offset of the first character of each page
+        with open_atomic(
+            os.path.join(self.output_path, f"idpage_{book_id}.npz"), mode="wb"
+        ) as f:
+            PageMap.from_pages(list_page_length).save(f)
 
     @staticmethod
     def normalize_txt(txt):
@@ -199,13 +269,72 @@ class SqlToCsv:
         txt = txt.replace("Œ", "E")
         return txt
 
+    @staticmethod
+    def get_line_functions(line_polygons, segment_polygons, segment_names):
+        """Return the function of each text_line, the h_tag of the last text_segment intersecting it or ""
+        The polygons are arrays of points, only the pairs with intersecting bounding boxes
+        are checked with shapely polygons"""
+        functions = np.full(len(line_polygons), "", dtype=object)
+        if not line_polygons or not segment_polygons:
+            return functions
+
+        line_bounds = polygon_bounds(line_polygons)
+        segment_bounds = polygon_bounds(segment_polygons)
+        # Pairs (segment, line) of intersecting bounding boxes, in the order of the segments
+        candidates = np.argwhere(
+            (segment_bounds[:, None, 0] <= line_bounds[None, :, 2])
+            & (line_bounds[None, :, 0] <= segment_bounds[:, None, 2])
+            & (segment_bounds[:, None, 1] <= line_bounds[None, :, 3])
+            & (line_bounds[None, :, 1] <= segment_bounds[:, None, 3])
+        )
+        shapes = {}
+        for index_segment, index_line in candidates:
+            if index_line not in shapes:
+                shapes[index_line] = Polygon(line_polygons[index_line])
+            if shapes[index_line].intersects(Polygon(segment_polygons[index_segment])):
+                functions[index_line] = segment_names[index_segment].split()[-1]
+        return functions
+
+    def get_texts(self, element_ids):
+        """Return the first transcription of each element of the loaded volume, "" without transcription"""
+        return [
+            texts[0] if texts else "" for texts in map(self.volume.texts, element_ids)
+        ]
+
+    @staticmethod
+    def get_bio_tags(df_volume):
+        """Return the [word, bio tag] of the words of the text of each line with its function
+        A word starts a text (B) when the function of its line differs from the one of the previous line with words,
+        the lines without function (none) are outside of the texts (O)"""
+        df_words = df_volume[["function"]].copy()
+        df_words["words"] = df_volume["text"].str.split()
+        df_words = df_words[df_words["words"].str.len() > 0]
+        if df_words.empty:
+            return []
+
+        function = df_words["function"]
+        previous = function.shift(1, fill_value="")
+        first_tags = np.where(
+            function == "none",
+            "O",
+            np.where(function == previous, "I-", "B-") + function,
+        )
+        next_tags = np.where(function == "none", "O", "I-" + function)
+
+        # The tag of the first word of a line, then the one of its next words
+        counts = df_words["words"].str.len().to_numpy()
+        tags = np.repeat(next_tags, counts)
+        tags[np.concatenate([[0], np.cumsum(counts)[:-1]])] = first_tags
+        words = [word for line in df_words["words"] for word in line]
+        return [[word, tag] for word, tag in zip(words, tags)]
+
     def save_bio_and_line_full(self, book_id, lit_function):
         """Save bio file for the 10 fully annotated volume and export also the text with a line fetching"""
         # Get pages
-        self.get_list_page(book_id)
+        self.load_volume(book_id)
 
-        # Create dataframe for the whole volume
-        df_volume = pd.DataFrame(columns=["id", "function", "page"])
+        # Dataframes of the pages, concatenated once for the whole volume
+        pages = [pd.DataFrame(columns=["id", "function", "page"])]
 
         # Add h_tag at each page that has text_segment
         for page in self.list_page_id:
@@ -213,22 +342,17 @@ class SqlToCsv:
             nb_page = page[1] + 1
 
             # Create dataframe for the text_line in the page
-            self.cursor.execute(
-                f"select id, polygon from element where id in (select child_id from element_path where parent_id='{id_page}') and type='text_line'"
-            )
-            df_text_lines = pd.DataFrame(
-                data=self.cursor.fetchall(), columns=["id", "polygon"]
+            df_text_lines = self.get_page_elements(
+                id_page, "text_line", ["id", "polygon"]
             )
 
-            # Turn polygon into shape
-            df_text_lines["polygon"] = df_text_lines.polygon.apply(
-                lambda x: Polygon(ast.literal_eval(str(x)))
-            )
+            # Turn polygon into an array of points
+            df_text_lines["polygon"] = df_text_lines.polygon.apply(parse_polygon)
 
             # Order the text_line with y coordinate of the center of polygon
-            df_text_lines["y_axis"] = df_text_lines.polygon.apply(
-                lambda a: a.centroid.y
-            )
+            df_text_lines["y_axis"] = polygon_centroids(
+                df_text_lines["polygon"].tolist()
+            )[:, 1]
             df_text_lines = df_text_lines.sort_values(by=["y_axis"])
             df_text_lines = df_text_lines.reset_index(drop=True)
 
@@ -236,172 +360,151 @@ class SqlToCsv:
             df_text_lines["function"] = ""
 
             # Find text_segment in the page
-            self.cursor.execute(
-                f"select name, polygon from element where id in (select child_id from element_path where parent_id='{id_page}') and type='text_segment'"
-            )
-
-            # Create dataframe for text_segment
-            df_text_segment = pd.DataFrame(
-                data=self.cursor.fetchall(), columns=["name", "polygon"]
+            df_text_segment = self.get_page_elements(
+                id_page, "text_segment", ["name", "polygon"]
             )
 
             # Check if there is text_segment
             if not df_text_segment.empty:
-                # Turn polygon into shape
+                # Turn polygon into an array of points
                 df_text_segment["polygon"] = df_text_segment.polygon.apply(
-                    lambda x: Polygon(ast.literal_eval(str(x)))
+                    parse_polygon
                 )
 
                 # Order text_segment
-                df_text_segment["y_axis"] = df_text_segment.polygon.apply(
-                    lambda a: a.centroid.y
-                )
+                df_text_segment["y_axis"] = polygon_centroids(
+                    df_text_segment["polygon"].tolist()
+                )[:, 1]
                 df_text_segment = df_text_segment.sort_values(by=["y_axis"])
                 df_text_segment = df_text_segment.reset_index(drop=True)
 
-                for index_segment, row_segment in df_text_segment.iterrows():
-                    for index_line, row_line in df_text_lines.iterrows():
-                        if row_line["polygon"].intersects(row_segment["polygon"]):
-                            df_text_lines.loc[index_line, "function"] = row_segment[
-                                "name"
-                            ].split()[-1]
+                df_text_lines["function"] = self.get_line_functions(
+                    df_text_lines["polygon"].tolist(),
+                    df_text_segment["polygon"].tolist(),
+                    df_text_segment["name"].tolist(),
+                )
 
             # Add the number of the page to the dataframe
             df_text_lines["page"] = nb_page
-            # Add to the dataframe of the volume
-            df_volume = pd.concat(
-                [df_volume, df_text_lines[["id", "function", "page"]]],
-                ignore_index=True,
-            )
+            pages.append(df_text_lines[["id", "function", "page"]])
 
-        # Initialize the dataframe if it doesn't begin with a function
-        if df_volume.loc[0, "function"] == "":
-            df_volume.loc[0, "function"] = "none"
+        df_volume = pd.concat(pages, ignore_index=True)
 
-        # Complete the empty row with missing value
-        for index_volume, row_volume in df_volume.iterrows():
-            if index_volume != 0 and row_volume["function"] == "":
-                df_volume.loc[index_volume, "function"] = df_volume.loc[
-                    index_volume - 1, "function"
-                ]
+        # Complete the empty row with the function of the previous one, "none" at the beginning of the volume
+        df_volume["function"] = (
+            df_volume["function"]
+            .mask(df_volume["function"] == "")
+            .ffill()
+            .fillna("none")
+        )
 
         # Remove the liturgical function that are not asked
         if lit_function:
             logging.info(lit_function)
 
-            # Find the liturgical function that are accepted
-            self.cursor.execute(
-                f"select name from element where id in (select child_id from element_path where parent_id in (select child_id from element_path where parent_id = '{book_id}')) and type = 'text_segment' and name like '%{lit_function}%'"
+            # Find the liturgical function that are accepted (case insensitive like the sql like)
+            df_function = pd.DataFrame(
+                data=[
+                    name
+                    for page in self.list_page_id
+                    for _, name, _ in self.volume.elements(page[0], "text_segment")
+                    if lit_function.lower() in name.lower()
+                ],
+                columns=["name"],
             )
-            df_function = pd.DataFrame(data=self.cursor.fetchall(), columns=["name"])
 
             # Get the h_tag
-            df_function["h_tag"] = ""
-            for index, row in df_function.iterrows():
-                row["h_tag"] = row["name"].split()[-1]
-
-            # Get a list of the h_tag
-            np_h_tag = df_function["h_tag"].to_numpy()
+            h_tags = df_function["name"].str.split().str[-1]
 
             # Suppress the function not wanted
-            for index, row in df_volume.iterrows():
-                if row["function"] not in np_h_tag:
-                    row["function"] = "none"
+            df_volume.loc[~df_volume["function"].isin(h_tags), "function"] = "none"
         else:
             logging.info("No liturgical function")
 
         # Add a column for the text
-        df_volume["text"] = ""
-
-        # Get transcription
-        for index, row in df_volume.iterrows():
-            self.cursor.execute(
-                f"""select text from transcription where element_id = '{row["id"]}';"""
-            )
-            text = self.cursor.fetchall()
-            if text:
-                row["text"] = text[0][0]
+        df_volume["text"] = self.get_texts(df_volume["id"])
 
         # Create bio tag
-        bio_data = []
-        function = ""
-        bio_tag = ""
-        for index, row in df_volume.iterrows():
-            if row["text"]:
-                for word in row["text"].split():
-                    if row["function"] == "none":
-                        bio_tag = "O"
-                    elif row["function"] == function and function != "none":
-                        bio_tag = f'I-{row["function"]}'
-                    elif row["function"] != function:
-                        bio_tag = f'B-{row["function"]}'
-                    # bio_data.append([word, bio_tag, row["page"]])
-                    bio_data.append([word, bio_tag])
-                    function = row["function"]
+        bio_data = self.get_bio_tags(df_volume)
 
         # Export bio file
-        with open(os.path.join(self.output_path, f"true_{book_id}.bio"), "a") as file:
+        with open_atomic(os.path.join(self.output_path, f"true_{book_id}.bio")) as file:
             for row in bio_data:
                 file.write(
                     f'{" ".join(self.normalize_txt(str(word)) for word in row)}\n'
                 )
 
         # Export line file
-        with open(os.path.join(self.output_path, f"line_{book_id}.txt"), "a") as file:
+        with open_atomic(os.path.join(self.output_path, f"line_{book_id}.txt")) as file:
             for row in bio_data:
                 file.write(f"{self.normalize_txt(row[0])} ")
 
+    def export_volumes(self, method, book_ids, *args):
+        """Export each volume with a method of the class, in a pool of processes if there are several jobs"""
+        if self.jobs > 1:
+            with ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=init_worker,
+                initargs=(self.db_name, self.output_path),
+            ) as executor:
+                futures = [
+                    executor.submit(run_worker, method, book_id, *args)
+                    for book_id in book_ids
+                ]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    counts, durations = future.result()
+                    self.database.counts.update(counts)
+                    self.database.durations.update(durations)
+        else:
+            for book_id in tqdm(book_ids):
+                getattr(self, method)(book_id, *args)
+
+    def save_fully_annotated_book(self, book_id, lit_function, empty_line):
+        self.save_bio_and_line_full(book_id, lit_function)
+        if empty_line:
+            self.collect_empty_transcription(book_id)
+
     def save_fully_annotated_books(self, lit_function, empty_line):
-        for book in tqdm(FULLY_ANNOTATED_VOLUME):
-            self.save_bio_and_line_full(book, lit_function)
-            if empty_line:
-                self.collect_empty_transcription(book)
+        self.export_volumes(
+            "save_fully_annotated_book",
+            FULLY_ANNOTATED_VOLUME,
+            lit_function,
+            empty_line,
+        )
 
         self.get_text_segment_complete(
             lit_function, FULLY_ANNOTATED_VOLUME, EXPORT_TEXT_SEGMENT
         )
 
     def save_bio_and_line_half(self, id_book, ref_meta):
-        # Get pages
-        self.get_list_page(id_book)
-
-        # Check type of page
-        self.check_type_page_from_book_id_complete(id_book)
+        # Get pages and type of page
+        self.load_volume(id_book)
 
-        # Create dataframe for the whole volume
-        df_volume = pd.DataFrame(columns=["id", "function"])
+        # Dataframes of the pages, concatenated once for the whole volume
+        pages = [pd.DataFrame(columns=["id", "function"])]
 
         # Add h_tag at each page that has text_segment
         for page in self.list_page_id:
             id_page = page[0]
 
             # Create dataframe for the text_line in the page
-            self.cursor.execute(
-                f"select id, polygon from element where id in (select child_id from element_path where parent_id='{id_page}') and type='text_line'"
-            )
-
-            df_text_lines = pd.DataFrame(
-                data=self.cursor.fetchall(), columns=["id", "polygon"]
+            df_text_lines = self.get_page_elements(
+                id_page, "text_line", ["id", "polygon"]
             )
 
             # If the page is not empty
             if len(df_text_lines.index):
 
-                # Turn polygon into shape
-                df_text_lines["polygon"] = df_text_lines.polygon.apply(
-                    lambda x: Polygon(ast.literal_eval(str(x)))
-                )
-                df_text_lines["y_axis"] = df_text_lines.polygon.apply(
-                    lambda a: a.centroid.y
-                )
+                # Turn polygon into an array of points
+                df_text_lines["polygon"] = df_text_lines.polygon.apply(parse_polygon)
+                centroids = polygon_centroids(df_text_lines["polygon"].tolist())
+                df_text_lines["y_axis"] = centroids[:, 1]
 
                 # Order the text segment if the volume is double paged
                 if self.type_page == "double page":
 
                     # Configuring the shape and the coordinates
-                    df_text_lines["x_axis"] = df_text_lines.polygon.apply(
-                        lambda a: a.centroid.x
-                    )  # order on which page
+                    df_text_lines["x_axis"] = centroids[:, 0]  # order on which page
 
                     # Create a limit between the pages
                     df_text_lines = df_text_lines.sort_values(by=["y_axis"])
@@ -434,76 +537,67 @@ class SqlToCsv:
                 df_text_lines["function"] = ""
 
                 # Find text_segment in the page
-                self.cursor.execute(
-                    f"select name, polygon from element where id in (select child_id from element_path where parent_id='{id_page}') and type='text_segment'"
-                )
-
-                # Create dataframe for text_segment
-                df_text_segment = pd.DataFrame(
-                    data=self.cursor.fetchall(), columns=["name", "polygon"]
+                df_text_segment = self.get_page_elements(
+                    id_page, "text_segment", ["name", "polygon"]
                 )
 
                 # Check if there is text_segment
                 if not df_text_segment.empty:
-                    # Turn polygon into shape
+                    # Turn polygon into an array of points
                     df_text_segment["polygon"] = df_text_segment.polygon.apply(
-                        lambda x: Polygon(ast.literal_eval(str(x)))
+                        parse_polygon
                     )
 
                     # Order text_segment
-                    df_text_segment["y_axis"] = df_text_segment.polygon.apply(
-                        lambda a: a.centroid.y
-                    )
+                    df_text_segment["y_axis"] = polygon_centroids(
+                        df_text_segment["polygon"].tolist()
+                    )[:, 1]
                     df_text_segment = df_text_segment.sort_values(by=["y_axis"])
                     df_text_segment = df_text_segment.reset_index(drop=True)
 
-                    for index_segment, row_segment in df_text_segment.iterrows():
-                        for index_line, row_line in df_text_lines.iterrows():
-                            if row_line["polygon"].intersects(row_segment["polygon"]):
-                                df_text_lines.loc[index_line, "function"] = row_segment[
-                                    "name"
-                                ].split()[-1]
+                    df_text_lines["function"] = self.get_line_functions(
+                        df_text_lines["polygon"].tolist(),
+                        df_text_segment["polygon"].tolist(),
+                        df_text_segment["name"].tolist(),
+                    )
 
-                df_volume = pd.concat(
-                    [df_volume, df_text_lines[["id", "function"]]],
-                    ignore_index=True,
-                )
+                pages.append(df_text_lines[["id", "function"]])
+
+        df_volume = pd.concat(pages, ignore_index=True)
 
         # Add a column for the text
-        df_volume["text"] = ""
-        # Get transcription
-        for index, row in df_volume.iterrows():
-            self.cursor.execute(
-                f"""select text from transcription where element_id = '{row["id"]}';"""
-            )
-            text = self.cursor.fetchall()
-            if text:
-                row["text"] = text[0][0]
+        df_volume["text"] = self.get_texts(df_volume["id"])
 
-        # Read number of word through ref metadata
+        # Read number of word through ref metadata, the last row of a function is kept
         with open(ref_meta, "r") as file:
-            ref_list = list(csv.reader(file, delimiter=","))
+            ref_words = {
+                ref_row[0]: int(ref_row[1])
+                for ref_row in csv.reader(file, delimiter=",")
+                if len(ref_row) > 1
+            }
+
+        # A text starts on the first line of a group of lines with a function
+        starts = (df_volume["function"] != "") & (
+            df_volume["function"].shift(1, fill_value="") == ""
+        )
 
         # Add the start of the tag
         word_start_tag = []
         tag = "O"
         word_count = 0
-        for i, r in df_volume.iterrows():
+        for start, function, text in zip(
+            starts, df_volume["function"], df_volume["text"]
+        ):
             # Check the tag function
-            if i != 0 and df_volume.loc[i - 1, "function"]:
-                pass
-            elif r["function"]:
-                tag = f'B-{r["function"]}'
-                for ref_row in ref_list:
-                    if ref_row[0] == r["function"]:
-                        word_count = int(ref_row[1]) + int(
-                            int(ref_row[1]) * 0.05
-                        )  # Add 5% for the merge error
-
-            if r["text"]:
-                for j, word in enumerate(r["text"].split()):
+            if start:
+                tag = f"B-{function}"
+                if function in ref_words:
+                    # Add 5% for the merge error
+                    word_count = ref_words[function] + int(ref_words[function] * 0.05)
+
+            if text:
+                for word in text.split():
                     word_start_tag.append([word, tag])
-                    print(word_count)
                     if word_count:
                         if word_count != 0:
                             tag = tag.replace("B", "I")
@@ -512,59 +606,51 @@ class SqlToCsv:
                             tag = "O"
 
         # Export bio file
-        with open(os.path.join(self.output_path, f"half_{id_book}.bio"), "a") as file:
+        with open_atomic(os.path.join(self.output_path, f"half_{id_book}.bio")) as file:
             for row in word_start_tag:
                 file.write(
                     f'{" ".join(self.normalize_txt(str(word)) for word in row)}\n'
                 )
 
         # Export line file
-        with open(os.path.join(self.output_path, f"line_{id_book}.txt"), "a") as file:
+        with open_atomic(os.path.join(self.output_path, f"line_{id_book}.txt")) as file:
             for row in word_start_tag:
                 file.write(f"{self.normalize_txt(row[0])} ")
 
     def save_half_annotated_books(self, ref_text):
-        for book in tqdm(HALF_ANNOTATED_VOLUME):
-            self.save_bio_and_line_half(book, ref_text)
+        self.export_volumes("save_bio_and_line_half", HALF_ANNOTATED_VOLUME, ref_text)
+
+    def get_segment_names(self, list_id_book, liturgical_function):
+        """Return the (id_book, name) of the text_segment of the books whose name contains the liturgical function
+        The pattern is the one of a sql like, case insensitive"""
+        return self.database.fetchall_by_ids(
+            "volumes_segment_names", (f"%{liturgical_function}%",), list(list_id_book)
+        )
 
     def get_text_segment_complete(
         self, liturgical_function, list_id_corpus, name_export
     ):
-
-        # Normalize the list of book id for the sql execution
-        list_sql_id_book = "("
-        for id_book in FULLY_ANNOTATED_VOLUME:
-            list_sql_id_book += id_book
-        list_sql_id_book += ")"
-
-        # Get the name of text segment with that are Psalm
-        self.cursor.execute(
-            f"select name from element where id in (select child_id from element_path where parent_id in (select child_id from element_path where parent_id in ({list_sql_id_book})) and type = 'text_segment' and name like '%Psalm%' group by name;"
+        """Export a csv with a row by volume and a column by h_tag of the text_segment of the liturgical function,
+        with 1 if the volume contains the text segment"""
+        list_id_corpus = list(list_id_corpus)
+        df_segment = pd.DataFrame(
+            self.get_segment_names(list_id_corpus, liturgical_function),
+            columns=["volume", "name"],
         )
 
-        # create an array with the good name for index and column
-        columns = [i[0] for i in self.cursor.fetchall()]
-        index = [i for i in list_id_corpus]
-
-        # Creation of the dataframe filled with 0 and with the id of volume as row and the name of text segment as column
-        df = pd.DataFrame(0, columns=columns, index=index)
-
-        # Put a 1 in the dataframe if the volume contain the text segment
-        for index, row in df.iterrows():
-            # Find text segment for each volume
-            self.cursor.execute(
-                f"select name from element where id in (select child_id from element_path where parent_id in (select child_id from element_path where parent_id = '{index}')) and type = 'text_segment' and name like '%{liturgical_function}%';"
+        if df_segment.empty:
+            # No text segment, a row of zeros without column for each volume
+            df = pd.DataFrame(0, index=list_id_corpus, columns=[])
+        else:
+            # The text segments are the columns in the order of their name
+            df = (
+                pd.crosstab(df_segment["volume"], df_segment["name"])
+                .clip(upper=1)
+                .reindex(index=list_id_corpus, fill_value=0)
             )
-            for i in self.cursor.fetchall():
-                if i[0] in df.columns:
-                    row[i[0]] = 1
-
-        new_column = []
-        for i in df.columns:
-            new_column.append(str(i).split()[-1])
-            # print(str(i).split()[-1])
-
-        df = df.set_axis(new_column, axis="columns")
+        df = df.set_axis(
+            [str(name).split()[-1] for name in df.columns], axis="columns"
+        ).rename_axis(index=None)
 
         # Extract the dataframe as a csv
         df.to_csv(
@@ -574,9 +660,8 @@ class SqlToCsv:
 
     def get_meta_vol(self):
         """Generate the metadata for a corpus (complete)"""
-        self.cursor.execute("select id, name from element where type = 'volume'")
         df_vol = pd.DataFrame.from_records(
-            data=self.cursor.fetchall(), columns=["id", "name"]
+            data=self.database.fetchall("volume_names"), columns=["id", "name"]
         )
         df_vol.to_csv(
             os.path.join(self.output_path, "metadata_volume.csv"),
@@ -586,36 +671,31 @@ class SqlToCsv:
     def collect_empty_transcription(self, id_book):
         """Collect the empty transcription text_line from a book"""
         logging.info(f"Checking text_line for volume {id_book}")
-        self.get_list_page(id_book)
+        self.load_volume(id_book)
 
         empty_transcription = [["id_page", "num_page", "id_text_line"]]
 
         # Check for all the page of the volume
         for id_page in self.list_page_id:
-            # Find ids of text_line from a page
-            self.cursor.execute(
-                f"select id from element where id in (select child_id from element_path where parent_id = '{id_page[0]}') and type='text_line'"
-            )
-
-            # Check if the text_line is empty for all text_line
-            for id_text_line in self.cursor.fetchall():
-                # Get the transcription from a text_line id
-                self.cursor.execute(
-                    f"select text from transcription where element_id='{id_text_line[0]}'"
-                )
-                if not self.cursor.fetchall():
-                    empty_transcription.append(
-                        [id_page[0], id_page[1], id_text_line[0]]
-                    )
+            # Check if the text_line is empty for all text_line of the page
+            for id_text_line, _, _ in self.volume.elements(id_page[0], "text_line"):
+                if not self.volume.texts(id_text_line):
+                    empty_transcription.append([id_page[0], id_page[1], id_text_line])
 
-        with open(
+        with open_atomic(
             os.path.join(self.output_path, f"empty-transcription_{id_book}.csv"),
-            "w",
             newline="",
         ) as f:
             writer = csv.writer(f)
             writer.writerows(empty_transcription)
 
+    def save_book(self, book_id, empty_line):
+        """Save the transcription of a book and its text_line without transcription"""
+        logging.info(f"Export of book {book_id}")
+        self.save_book_complete_para(book_id)
+        if empty_line:
+            self.collect_empty_transcription(book_id)
+
     def managing_function(self, metadata_volume, empty_line):
         """Manage the export for the parameter given
         Will export the transcription for all the volume in the database
@@ -623,12 +703,9 @@ class SqlToCsv:
         Can generate the metadata for the volumes"""
         self.get_list_book()
 
-        for id_book in tqdm(self.list_book_id):
-            print(id_book[0])
-            self.save_book_complete_para(id_book[0])
-
-            if empty_line:
-                self.collect_empty_transcription(id_book[0])
+        self.export_volumes(
+            "save_book", [id_book[0] for id_book in self.list_book_id], empty_line
+        )
 
         if metadata_volume:
             self.get_meta_vol()
@@ -696,10 +773,43 @@ def main():
         required=False,
         action="store_true",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes exporting the volumes, each one with its own read-only connection",
+        required=False,
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--prepare-db",
+        help="Create the missing indexes used by the export in the sqlite db and run ANALYZE before the export",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--explain",
+        help="Log the query plan of the queries of the export before running it",
+        required=False,
+        action="store_true",
+    )
 
     args = vars(parser.parse_args())
 
-    with SqlToCsv(args["sql_file"], args["output_path"]) as f:
+    # The database is only opened in write mode to create the indexes
+    with SqlToCsv(
+        args["sql_file"],
+        args["output_path"],
+        read_only=not args["prepare_db"],
+        jobs=args["jobs"],
+    ) as f:
+
+        if args["prepare_db"]:
+            logging.info("Preparation of the database")
+            prepare_database(f.database.connection)
+
+        if args["explain"]:
+            f.explain()
 
         # f.save_book_complete_para('6d6e6acd-393b-4f66-bdd5-4d9f06ad5c24')
 
@@ -719,6 +829,14 @@ def main():
         else:
             f.managing_function(args["metadata_volume"], args["empty_line"])
 
+        # Text segments of the liturgical function in each volume of the database
+        if args["text_segment"]:
+            f.get_text_segment_complete(
+                args["liturgical_function"],
+                [id_book[0] for id_book in f.get_list_book()],
+                EXPORT_TEXT_SEGMENT_CORPUS,
+            )
+
 
 if __name__ == "__main__":
     main()
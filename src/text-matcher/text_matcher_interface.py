@@ -7,17 +7,47 @@ import glob
 import itertools
 import logging
 import os.path
+import re
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
 from pathlib import Path, PurePosixPath
 
+import numpy as np
 import pandas as pd
-from text_matcher.matcher import Matcher, Text
+from horae_reference_texts.metadata import HeuristMetadata
+from horae_sql.page_map import PageMap
+from horae_text_matcher.disk_cache import DiskTextCache
+from horae_text_matcher.ngram_index import NgramIndex, folder_signature
+from horae_text_matcher.shared_blocks import SharedBlocksMatcher
+from horae_text_matcher.similarity import ReferenceSimilarity
+from horae_text_matcher.text_cache import PreparedText, TextCache
 from text_matcher.text_matcher import getFiles
 
 ARKINDEX_VOLUME_URL = "https://arkindex.teklia.com/element/"
 HEURIST_TEXT_URL = "https://heurist.huma-num.fr/heurist/hclient/framecontent/recordEdit.php?db=stutzmann_horae&recID="
 DATE = datetime.today().strftime("%Y-%m-%d")
 
+# Instance of CreatingHtml used by the processes of the pool
+worker_creation = None
+
+
+def init_worker(creation):
+    """Share the instance of CreatingHtml with the process of the pool"""
+    global worker_creation
+    worker_creation = creation
+
+
+def run_worker(text, ref, df):
+    """Apply the matcher on a volume inside a process of the pool"""
+    return worker_creation.new_interface(text, ref, df)
+
+
+def run_sweep_worker(text, ref, df, combinations):
+    """Apply the matcher on a volume with each combination of parameters inside a process of the pool"""
+    return worker_creation.sweep_volume(text, ref, df, combinations)
+
 
 class CreatingHtml:
     def __init__(
@@ -34,12 +64,16 @@ class CreatingHtml:
         mindistance,
         match_merger,
         extended_match,
+        workers=1,
+        text_cache_size=512,
+        disk_cache=True,
     ):
         """Initiate the class"""
         self.volumes = volume_path
         self.link = self.get_file_or_none(link_path)
         self.reference = references_path
         self.metadata_heurist = metadata_path
+        self.metadata = HeuristMetadata(metadata_path)
         self.output_path = output_path
         self.normalize = normalize
         self.threshold = threshold
@@ -48,16 +82,39 @@ class CreatingHtml:
         self.minDistance = mindistance
         self.match_merger = match_merger
         self.extended_match = extended_match
+        self.workers = workers
 
         # List of ref text in order of apparition and link of arkindex for the page
         self.list_order_ref = []
 
+        # N-gram index of the reference texts by folder and n-gram size
+        self.ngram_indexes = {}
+
+        # Text objects already prepared for the matcher, the size is given in MB
+        self.text_cache = TextCache(text_cache_size * 1024 * 1024)
+
+        # Prepared texts shared between the runs, by content
+        self.disk_cache = DiskTextCache() if disk_cache else None
+
+        # Number of characters of the reference texts by folder
+        self.reference_lengths = {}
+
+        # Blocks of common n-grams by pair of texts, only kept during a sweep
+        self.matching_blocks = None
+
         logging.info(normalize)
 
     @staticmethod
     def get_file_or_none(link_path):
+        """List the idpage files of a folder, the npz page maps and the csv files of the previous format"""
         if link_path:
-            return getFiles(str(link_path))
+            if os.path.isfile(link_path):
+                return [str(link_path)]
+            return sorted(
+                path
+                for pattern in ("**/*.npz", "**/*.txt")
+                for path in glob.glob(os.path.join(link_path, pattern), recursive=True)
+            )
         else:
             return None
 
@@ -77,48 +134,90 @@ class CreatingHtml:
         txt = txt.replace("Œ", "E")
         return txt
 
+    def create_text(self, text, filename):
+        """Create the text object used by the matcher"""
+        if self.normalize:
+            text = self.normalize_txt(text)
+        if self.disk_cache:
+            return self.disk_cache.get(text, filename, self.ngrams)
+        return PreparedText(text, filename)
+
+    def get_text(self, filename):
+        """Return the text object of a file, it is only prepared once if it stays in the cache"""
+        key = TextCache.key(filename, self.normalize, self.ngrams)
+        text_obj = self.text_cache.get(key)
+        if text_obj is None:
+            text_obj = self.create_text(self.read_text(filename), filename)
+            text_obj.ngrams(self.ngrams)
+            self.text_cache.put(key, text_obj)
+        return text_obj
+
+    @staticmethod
+    def read_text(filename):
+        with open(filename, errors="ignore") as f:
+            return f.read()
+
+    def get_ngram_index(self, root, filenames):
+        """Load or build the n-gram index of the reference texts"""
+        key = (os.path.abspath(root), self.ngrams)
+        if key in self.ngram_indexes:
+            return self.ngram_indexes[key]
+
+        signature = folder_signature(root, filenames, self.ngrams, self.normalize)
+        index_path = NgramIndex.index_path(root, self.ngrams, self.normalize)
+        # Only the index of a folder of references is worth keeping between runs
+        index = NgramIndex.load(index_path, signature) if os.path.isdir(root) else None
+        if index is None:
+            logging.info(f"Building the n-gram index of {root}")
+            index = NgramIndex(self.ngrams, signature)
+            for filename in filenames:
+                index.add(
+                    os.path.relpath(filename, root),
+                    self.get_text(filename),
+                )
+            if os.path.isdir(root):
+                try:
+                    index.save(index_path)
+                except OSError as e:
+                    logging.warning(f"Failed to save the n-gram index: {e}")
+
+        self.ngram_indexes[key] = index
+        return index
+
     def getting_info(self, text1, text2, stops):
         """Apply the matching algorithm to the texts"""
         texts1 = getFiles(text1)
         texts2 = getFiles(text2)
 
-        pairs = list(itertools.product(texts1, texts2))
-
-        texts = {}
-        prevTextObjs = {}
-        for filename in texts1 + texts2:
-            with open(filename, errors="ignore") as f:
-                text = f.read()
-            if filename not in texts:
-                texts[filename] = text
+        # Only match the texts against the references sharing enough n-grams with them
+        ngram_index = self.get_ngram_index(text2, texts2)
+        pairs = []
+        for filenameA in texts1:
+            candidates = ngram_index.candidates(
+                self.get_text(filenameA), self.threshold
+            )
+            pairs += [
+                (filenameA, filenameB)
+                for filenameB in texts2
+                if os.path.relpath(filenameB, text2) in candidates
+            ]
+        logging.info(
+            f"{len(pairs)} pairs to match out of {len(texts1) * len(texts2)} after n-gram filtering"
+        )
 
         list_object = []
         for index, pair in enumerate(pairs):
             filenameA, filenameB = pair[0], pair[1]
 
-            # Put this in a dictionary, so we don't have to process a file twice.
-            for filename in [filenameA, filenameB]:
-                if filename not in prevTextObjs:
-                    if self.normalize:
-                        prevTextObjs[filename] = Text(
-                            self.normalize_txt(texts[filename]), filename
-                        )
-                        # logging.info("Normalization Done")
-                    else:
-                        prevTextObjs[filename] = Text(texts[filename], filename)
-
-            # Just more convenient naming.
-            textObjA = prevTextObjs[filenameA]
-            textObjB = prevTextObjs[filenameB]
-
-            # Reset the table of previous text objects, so we don't overload memory.
-            # This means we'll only remember the previous two texts.
-            prevTextObjs = {filenameA: textObjA, filenameB: textObjB}
+            # The text objects are kept in the cache, so we don't have to process a file twice.
+            textObjA = self.get_text(filenameA)
+            textObjB = self.get_text(filenameB)
 
             # Do the matching.
-            myMatch = Matcher(
+            myMatch = SharedBlocksMatcher(
                 textObjA,
                 textObjB,
+                blocks=self.matching_blocks,
                 threshold=self.threshold,
                 cutoff=self.cutoff,
                 ngramSize=self.ngrams,
@@ -133,7 +232,8 @@ class CreatingHtml:
         return list_object
 
     def new_interface(self, text, ref, df):
-        """Create a html and a bio file for a txt file"""
+        """Create a html and a bio file for a txt file
+        Return the rows of the volume for list_order_ref and the evaluation dataframe"""
         # Prepare the list of match
         match = self.getting_info(text, ref, False)
 
@@ -142,43 +242,16 @@ class CreatingHtml:
             text_raw = file_text.read()
 
         # Organizing match
-        list_match = []
-        save_ref_name = []
         len_text = len(text_raw)
-        for ref_match in reversed(match):
-            name_ref = os.path.basename(ref_match[0]).replace(".txt", "")
-            for i in range(len(ref_match[1])):
-                if not self.extended_match:
+        if self.extended_match:
+            list_match = self.extend_matches(match, ref, len_text)
+        else:
+            list_match = []
+            for ref_match in reversed(match):
+                name_ref = os.path.basename(ref_match[0]).replace(".txt", "")
+                for i in range(len(ref_match[1])):
                     list_match.append([ref_match[1][i], ref_match[2][i], name_ref])
 
-                if name_ref not in save_ref_name and self.extended_match:
-                    with open(os.path.join(ref, f"{name_ref}.txt"), "r") as psalm_file:
-                        len_ref_text = psalm_file.read().__len__()
-                        # Replace first position from the number of character before the match in the ref text
-                        if ref_match[1][i][0] - ref_match[2][i][0] < 0:
-                            first_position = 0
-                        else:
-                            first_position = ref_match[1][i][0] - ref_match[2][i][0]
-
-                        # Replace last position from the number of character after the match in the ref text
-                        if (
-                            ref_match[1][i][1] + (len_ref_text - ref_match[2][i][1])
-                            > len_text
-                        ):
-                            last_position = len_text - 1
-                        else:
-                            last_position = ref_match[1][i][1] + (
-                                len_ref_text - ref_match[2][i][1]
-                            )
-                        list_match.append(
-                            [
-                                (first_position, last_position),
-                                (0, len_ref_text),
-                                name_ref,
-                            ]
-                        )
-                    save_ref_name.append(name_ref)
-
         df_match = pd.DataFrame(
             data=list_match, columns=["pos_text", "pos_ref", "name_ref"]
         )
@@ -186,32 +259,30 @@ class CreatingHtml:
         # Order the match in function of their localization in the text
         match = sorted(match, key=lambda x: x[1])
 
-        # Copy text for bio file
-        true_text = []
-        bio_text = []
-        for letter in text_raw:
-            bio_text.append([letter, "O"])
-            true_text.append([letter, ""])
-
-        # Read the metadata
-        with open(self.metadata_heurist, newline="") as meta_file:
-            meta = list(csv.reader(meta_file, delimiter=","))
+        # Position of the B and E tags of the matches in the text
+        bio_markers = {}
 
         # Create the name of the output file
         id_volume = os.path.basename(text).split("_")[-1].replace(".txt", "")
         output_name = "_".join([DATE, id_volume])
 
         # Find and check the link file containing the page_id for each word
-        if self.link:
-
-            path_match = [path for path in self.link if (id_volume in path)]
+        page_map = None
+        if self.link is not None:
+
+            path_match = [
+                path for path in self.link if id_volume in os.path.basename(path)
+            ]
+            # The csv file of the previous format can be kept next to the npz one
+            path_match = [
+                path for path in path_match if path.endswith(".npz")
+            ] or path_match
+            if not path_match:
+                raise FileNotFoundError(
+                    f"No idpage file for the volume {id_volume} in the link folder"
+                )
             assert len(path_match) == 1
-            path_link = path_match[0]
-
-            # Read info for page
-            if path_link:
-                with open(path_link, newline="") as link_file:
-                    link_data = list(csv.reader(link_file, delimiter=","))
+            page_map = PageMap.load(path_match[0])
 
         # Get the Arkindex link
         volume_url = os.path.join(ARKINDEX_VOLUME_URL, id_volume)
@@ -223,39 +294,25 @@ class CreatingHtml:
         # Indicate position of beginning and end in the table of text
         for index, row in df_match.sort_values(by="pos_text").iterrows():
             # Get information from the metadata
-            for data in meta:
-                if data[0] == row["name_ref"]:
-                    h_tag = data[1].split()[-1]
-                    name_text = data[1].split("|")[-3]
+            heurist_text = self.metadata.by_id[row["name_ref"]]
             # Add the tag
-            bio_text[row["pos_text"][0]][1] = f"B-{h_tag}"
-            bio_text[row["pos_text"][1]][1] = "E"
-            list_ref.append(name_text)
-            list_link.append(
-                os.path.join(ARKINDEX_VOLUME_URL, link_data[row["pos_text"][0]][1])
-            )
+            bio_markers[row["pos_text"][0]] = f"B-{heurist_text.h_tag}"
+            bio_markers[row["pos_text"][1]] = "E"
+            list_ref.append(heurist_text.name)
+            # The page links are only exported with the idpage files
+            if page_map is not None:
+                list_link.append(
+                    os.path.join(ARKINDEX_VOLUME_URL, page_map.page(row["pos_text"][0]))
+                )
+            else:
+                list_link.append(None)
 
         # Add info of match on list_order_ref to be exported
         assert len(list_ref) == len(list_link)
-        self.list_order_ref.append(list_ref)
-        self.list_order_ref.append(list_link)
+        order_ref = [list_ref, list_link]
 
         # Create the table with word and bio tag
-        tag = "O"
-        word = []
-        bio_list = []
-        for row in bio_text:
-            if row[0] == " ":
-                bio_list.append(["".join(word), tag])
-                if "B" in tag:
-                    tag = tag.replace("B", "I")
-                if "E" in row[1]:
-                    tag = "O"
-                word = []
-            else:
-                word.append(row[0])
-                if "B" in row[1]:
-                    tag = row[1]
+        bio_list = self.create_bio_list(text_raw, bio_markers)
 
         # Merge match with the same tag if they are next to each other
         if self.match_merger:
@@ -312,65 +369,71 @@ class CreatingHtml:
             ):
                 count_overlap += 1
 
-        # HTML Creation
+        # Assert that all matches where treated
+        assert len(df_match) == len(list_match)
+
+        # Writing in html file, the text of the volume is written word by word
+        with open(
+            os.path.join(
+                self.output_path,
+                f"Zline_{self.threshold}{self.cutoff}{self.ngrams}{self.minDistance}_{output_name}.html",
+            ),
+            "w",
+        ) as html_file:
+            html_file.write(
+                '<html><head><meta charset="UTF-8"><link rel="stylesheet" href="style.css"><title>Text Matcher</title></head><body>'
+            )
+            html_file.write("<h1>Text matcher interface</h1>")
+            html_file.write(
+                f'<p><a href="{volume_url}">Lien du volume sur Arkindex</a></p>'
+            )
+            html_file.write(f"<p>Number of recognised texts : {str(len(match))}</p>")
+            html_file.write(f"<p>Number of match : {str(len(list_match))}</p>")
+            html_file.write(
+                f"<p>Parameters of the match:<br> threshold: {self.threshold}, cutoff: {self.cutoff}, ngrams: {self.ngrams}, minDistance: {self.minDistance}</p>"
+            )
+            html_file.write(f"<p>Number of overlapping match : {count_overlap}</p>")
+            html_file.write("<h2>Text du volume</h2><p>")
+            self.write_html_text(html_file, bio_list, df_match, ref)
+            html_file.write("</p>")
+            html_file.write("</body></html>")
+
+        return order_ref, df.loc[id_volume]
+
+    def write_html_text(self, html_file, bio_list, df_match, ref):
+        """Write the words of the volume with the matches highlighted and the reference texts in the margin"""
         end_tag = "</marka>"
         start_tag = "<marka>"
-        html_text = ""
         list_save_ref = []
         for i, word in enumerate(bio_list):
             if i == len(bio_list) - 1:
                 pass
             elif word[1] == "O":
-                html_text += word[0] + " "
+                html_file.write(word[0] + " ")
             elif word[1][0] == "B":
-                # Adding the ref text in the merge with highlight on matched words
-                text_ref = ""
                 # Check if the text hasn't already been treated
                 if word[1].split("-")[1] not in list_save_ref:
                     # List the treated reference text
                     list_save_ref.append(word[1].split("-")[1])
 
                     # Get information from the metadata
-                    id_ref = ""
-                    heurist_name = ""
-                    for data in meta:
-                        if word[1].split("-")[1] in data[1]:
-                            heurist_name = f"<b>{data[1]}</b><br>"
-                            id_ref = data[0]
-
-                    # Sort a dataframe containing the proper information on the reference text
-                    df_name = df_match[df_match["name_ref"] == id_ref]
+                    heurist_text = self.metadata.by_tag[word[1].split("-")[1]]
+                    heurist_name = f"<b>{heurist_text.annotation}</b><br>"
+                    id_ref = heurist_text.arkindex_id
 
                     # Get the reference text
                     with open(os.path.join(ref, f"{id_ref}.txt"), "r") as psalm_file:
                         text_ref = self.normalize_txt(psalm_file.read())
 
-                    # Add the proper tag to the reference text
-                    for index_name, row_name in df_name.sort_values(
-                        by="pos_ref", ascending=False
-                    ).iterrows():
-                        text_ref = (
-                            text_ref[: row_name["pos_ref"][1]]
-                            + "</mark>"
-                            + text_ref[row_name["pos_ref"][1] :]
-                        )
-                        text_ref = (
-                            text_ref[: row_name["pos_ref"][0]]
-                            + "<mark>"
-                            + text_ref[row_name["pos_ref"][0] :]
-                        )
-
-                    # Adding the final tag
-                    text_ref = (
-                        '<span class="marginnote">'
-                        + heurist_name
-                        + text_ref
-                        + "</span>"
-                    )
+                    # Adding the reference text in the margin with highlight on matched words
+                    df_name = df_match[df_match["name_ref"] == id_ref]
+                    html_file.write('<span class="marginnote">' + heurist_name)
+                    html_file.write(self.mark_text(text_ref, df_name["pos_ref"]))
+                    html_file.write("</span>")
 
-                html_text += text_ref + start_tag + word[0] + " "
+                html_file.write(start_tag + word[0] + " ")
                 if bio_list[i + 1][1][0] == "B":
-                    html_text += end_tag
+                    html_file.write(end_tag)
                     # Change the color of the match for a better visibility
                     if start_tag == "<marka>":
                         start_tag = "<markb>"
@@ -380,9 +443,9 @@ class CreatingHtml:
                         end_tag = "</marka>"
 
             elif word[1][0] == "I":
-                html_text += word[0] + " "
+                html_file.write(word[0] + " ")
                 if bio_list[i + 1][1][0] != "I":
-                    html_text += end_tag
+                    html_file.write(end_tag)
                     # Change the color of the match for a better visibility
                     if start_tag == "<marka>":
                         start_tag = "<markb>"
@@ -391,38 +454,211 @@ class CreatingHtml:
                         start_tag = "<marka>"
                         end_tag = "</marka>"
 
-        # Assert that all matches where treated
-        assert len(df_match) == len(list_match)
+    @staticmethod
+    def mark_text(text, spans):
+        """Surround the spans of a text with mark tags, in one pass over the sorted positions
+        At the same position, the closing tags are written before the opening ones"""
+        tags = sorted(
+            [(end, 0, "</mark>") for _, end in spans]
+            + [(start, 1, "<mark>") for start, _ in spans]
+        )
+        parts = []
+        last_position = 0
+        for position, _, tag in tags:
+            parts.append(text[last_position:position])
+            parts.append(tag)
+            last_position = position
+        parts.append(text[last_position:])
+        return "".join(parts)
 
-        # Writing in html file
-        with open(
-            os.path.join(
-                self.output_path,
-                f"Zline_{self.threshold}{self.cutoff}{self.ngrams}{self.minDistance}_{output_name}.html",
-            ),
-            "w",
-        ) as html_file:
-            html_file.write(
-                '<html><head><meta charset="UTF-8"><link rel="stylesheet" href="style.css"><title>Text Matcher</title></head><body>'
-            )
-            html_file.write("<h1>Text matcher interface</h1>")
-            html_file.write(
-                f'<p><a href="{volume_url}">Lien du volume sur Arkindex</a></p>'
-            )
-            html_file.write(f"<p>Number of recognised texts : {str(len(match))}</p>")
-            html_file.write(f"<p>Number of match : {str(len(list_match))}</p>")
-            html_file.write(
-                f"<p>Parameters of the match:<br> threshold: {self.threshold}, cutoff: {self.cutoff}, ngrams: {self.ngrams}, minDistance: {self.minDistance}</p>"
+    @staticmethod
+    def create_bio_list(text_raw, bio_markers):
+        """Tag the words of the text, each word ends with a space
+        A B tag inside a word starts a match, an E tag on the space ending a word ends it"""
+        spaces = [space.start() for space in re.finditer(" ", text_raw)]
+
+        # Index of the word of each tag, the space ending a word belongs to the word
+        word_markers = {}
+        for pos, marker in sorted(bio_markers.items()):
+            word_markers.setdefault(bisect_left(spaces, pos), []).append((pos, marker))
+
+        tag = "O"
+        bio_list = []
+        start = 0
+        for index, space in enumerate(spaces):
+            for pos, marker in word_markers.get(index, []):
+                if pos != space and "B" in marker:
+                    tag = marker
+            bio_list.append([text_raw[start:space], tag])
+            if "B" in tag:
+                tag = tag.replace("B", "I")
+            if "E" in bio_markers.get(space, ""):
+                tag = "O"
+            start = space + 1
+        return bio_list
+
+    def extend_matches(self, match, ref, len_text):
+        """Extend the first match of each reference text to the whole reference text
+        The position of the match in the volume is moved by the number of characters before and after it in the reference"""
+        ref_lengths = self.get_reference_lengths(ref)
+        ref_matches = [ref_match for ref_match in reversed(match) if ref_match[1]]
+        if not ref_matches:
+            return []
+
+        names = [
+            os.path.basename(ref_match[0]).replace(".txt", "")
+            for ref_match in ref_matches
+        ]
+        pos_text = np.array([ref_match[1][0] for ref_match in ref_matches])
+        pos_ref = np.array([ref_match[2][0] for ref_match in ref_matches])
+        len_refs = np.array([ref_lengths[name] for name in names])
+
+        # Replace first position from the number of character before the match in the ref text
+        first_positions = np.clip(pos_text[:, 0] - pos_ref[:, 0], 0, None)
+
+        # Replace last position from the number of character after the match in the ref text
+        last_positions = pos_text[:, 1] + len_refs - pos_ref[:, 1]
+        last_positions = np.where(
+            last_positions > len_text, len_text - 1, last_positions
+        )
+
+        return [
+            [(first_position, last_position), (0, len_ref_text), name_ref]
+            for first_position, last_position, len_ref_text, name_ref in zip(
+                first_positions.tolist(),
+                last_positions.tolist(),
+                len_refs.tolist(),
+                names,
             )
-            html_file.write(f"<p>Number of overlapping match : {count_overlap}</p>")
-            html_file.write(f"<h2>Text du volume</h2><p>{html_text}</p>")
-            html_file.write("</body></html>")
+        ]
+
+    def get_reference_lengths(self, ref):
+        """Number of characters of each reference text of a folder, by name"""
+        if ref not in self.reference_lengths:
+            self.reference_lengths[ref] = {
+                os.path.basename(filename).replace(".txt", ""): len(
+                    self.read_text(filename)
+                )
+                for filename in getFiles(ref)
+            }
+        return self.reference_lengths[ref]
 
     def create_html(self):
         """Handle the generation of html from txt file and the passing of arguments for one ou multiple input"""
         # Get the path of the text in the htmls
         texts = getFiles(self.volumes)
+        eval_df = self.create_eval_df(texts)
+
+        # Go through the volumes and apply text-matcher to them while creating html
+        if self.workers > 1:
+            # Build the index of the references once before sharing it with the workers
+            self.get_ngram_index(str(self.reference), getFiles(str(self.reference)))
+            if self.extended_match:
+                self.get_reference_lengths(str(self.reference))
+            with ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_worker, initargs=(self,)
+            ) as executor:
+                results = list(
+                    executor.map(
+                        run_worker,
+                        [str(filename) for filename in texts],
+                        repeat(str(self.reference)),
+                        repeat(eval_df),
+                    )
+                )
+        else:
+            results = [
+                self.new_interface(str(filename), str(self.reference), eval_df)
+                for filename in texts
+            ]
+
+        self.export_results(results, eval_df)
+
+    def sweep(self, thresholds, cutoffs, ngrams_values, mindistances):
+        """Apply the matcher with each combination of parameters, the results of a combination are saved in its own folder
+        The texts are prepared once by size of n-grams and the blocks of common n-grams once by pair of texts"""
+        output_path = self.output_path
+        parameters = (self.ngrams, self.threshold, self.cutoff, self.minDistance)
+        combinations = list(
+            itertools.product(ngrams_values, thresholds, cutoffs, mindistances)
+        )
+        logging.info(f"Sweeping {len(combinations)} combinations of parameters")
+
+        texts = getFiles(self.volumes)
+        eval_df = self.create_eval_df(texts)
+        self.matching_blocks = {}
+        for combination in combinations:
+            os.makedirs(self.sweep_folder(output_path, combination), exist_ok=True)
+
+        # Each volume is matched with all the combinations before the next one
+        if self.workers > 1:
+            for ngrams in ngrams_values:
+                self.ngrams = ngrams
+                self.get_ngram_index(str(self.reference), getFiles(str(self.reference)))
+            if self.extended_match:
+                self.get_reference_lengths(str(self.reference))
+            with ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_worker, initargs=(self,)
+            ) as executor:
+                results = list(
+                    executor.map(
+                        run_sweep_worker,
+                        [str(filename) for filename in texts],
+                        repeat(str(self.reference)),
+                        repeat(eval_df),
+                        repeat(combinations),
+                    )
+                )
+        else:
+            results = [
+                self.sweep_volume(
+                    str(filename), str(self.reference), eval_df, combinations
+                )
+                for filename in texts
+            ]
+
+        for index, combination in enumerate(combinations):
+            self.set_parameters(*combination)
+            self.output_path = self.sweep_folder(output_path, combination)
+            self.list_order_ref = []
+            self.export_results(
+                [volume_results[index] for volume_results in results], eval_df.copy()
+            )
+
+        self.matching_blocks = None
+        self.output_path = output_path
+        self.set_parameters(*parameters)
+
+    def sweep_volume(self, text, ref, df, combinations):
+        """Apply the matcher on a volume with each combination of parameters"""
+        output_path = self.output_path
+        results = []
+        for combination in combinations:
+            self.set_parameters(*combination)
+            self.output_path = self.sweep_folder(output_path, combination)
+            results.append(self.new_interface(text, ref, df))
+        self.output_path = output_path
+
+        # The blocks of the volume won't be used again
+        self.matching_blocks.clear()
+        return results
+
+    def set_parameters(self, ngrams, threshold, cutoff, mindistance):
+        self.ngrams = ngrams
+        self.threshold = threshold
+        self.cutoff = cutoff
+        self.minDistance = mindistance
+
+    @staticmethod
+    def sweep_folder(output_path, combination):
+        """Folder of the results of a combination of parameters of the sweep"""
+        ngrams, threshold, cutoff, mindistance = combination
+        return os.path.join(
+            output_path, f"t{threshold}_c{cutoff}_g{ngrams}_d{mindistance}"
+        )
 
+    def create_eval_df(self, texts):
+        """Create the evaluation dataframe with a row by volume and a column by reference text"""
         # Creation of the column for the evaluation df
         eval_df = pd.read_csv(self.metadata_heurist)
         columns = eval_df["ID Annotation"].to_numpy()
@@ -433,11 +669,14 @@ class CreatingHtml:
             index.append(os.path.basename(filename).split("_")[-1].replace(".txt", ""))
 
         # Creation of the df
-        eval_df = pd.DataFrame(0, columns=columns, index=index)
+        return pd.DataFrame(0, columns=columns, index=index)
 
-        # Go through the volumes and apply text-matcher to them while creating html
-        for filename in texts:
-            self.new_interface(str(filename), str(self.reference), eval_df)
+    def export_results(self, results, eval_df):
+        """Merge the results of the volumes and export order_ref.csv and the evaluation dataframe"""
+        # Merge the results of the volumes in the order of the files
+        for order_ref, eval_row in results:
+            self.list_order_ref += order_ref
+            eval_df.loc[eval_row.name] = eval_row
 
         if self.link:
             with open(os.path.join(self.output_path, "order_ref.csv"), "w") as csv_file:
@@ -524,10 +763,6 @@ class CreatingHtml:
                     ["end", index, df_bio.loc[index - 1, "h_tag"].split("-")[1]]
                 )
 
-        # Read the metadata
-        with open(self.metadata_heurist, newline="") as meta_file:
-            data = list(csv.reader(meta_file, delimiter=","))
-
         # Creation of the link for the html
         volume_url = os.path.join(ARKINDEX_VOLUME_URL, volume_id)
 
@@ -538,15 +773,14 @@ class CreatingHtml:
         for row in reversed(list_index):
             if row[0] == "start":
                 # word_list.insert(row[1], start_tag)
-                for data_row in data:
-                    if data_row[1].split()[-1] == row[2]:
-                        word_list.insert(
-                            row[1],
-                            (
-                                start_tag
-                                + f'<span class="marginnote">{data_row[1]}</span>'
-                            ),
-                        )
+                if row[2] in self.metadata.by_tag:
+                    word_list.insert(
+                        row[1],
+                        (
+                            start_tag
+                            + f'<span class="marginnote">{self.metadata.by_tag[row[2]].annotation}</span>'
+                        ),
+                    )
 
             elif row[0] == "end":
                 word_list.insert(row[1], end_tag)
@@ -572,31 +806,29 @@ class CreatingHtml:
             html_file.write("</body></html>")
 
     def ref_on_ref(self):
-        ref_files1 = getFiles(self.volumes)
-        ref_files2 = getFiles(str(self.reference))
-
-        # Read the metadata
-        with open(self.metadata_heurist, newline="") as meta_file:
-            meta = list(csv.reader(meta_file, delimiter=","))
-
-        ref_tab = []
-        list_nb_word_max = []
+        """Compare the reference texts with each other, each pair is only matched once"""
+        ref_files = getFiles(str(self.reference))
+
+        similarity = ReferenceSimilarity(
+            self.get_ngram_index(str(self.reference), ref_files),
+            self.threshold,
+            self.cutoff,
+            self.ngrams,
+            self.minDistance,
+        )
         list_name_ref = []
+        for ref_file in ref_files:
+            id_ref = os.path.basename(ref_file).replace(".txt", "")
+            list_name_ref.append(self.metadata.by_id[id_ref].name)
+            # The key is the one of the reference in the n-gram index
+            similarity.add(
+                os.path.relpath(ref_file, str(self.reference)),
+                self.read_text(ref_file),
+                self.get_text(ref_file),
+            )
 
-        for i, text1 in enumerate(ref_files1):
-            for ref in meta:
-                if ref[0] in text1:
-                    list_name_ref.append(ref[1].split("|")[-3])
-
-            ref_tab.append([])
-            for text2 in ref_files2:
-                if self.count_word_in_match(text1, text2):
-                    nb_word_matched = self.count_word_in_match(text1, text2)
-                    ref_tab[i].append(nb_word_matched)
-                else:
-                    ref_tab[i].append(0)
-                if text1 == text2:
-                    list_nb_word_max.append(nb_word_matched)
+        ref_tab = similarity.matrix()
+        list_nb_word_max = similarity.nb_words
 
         ratio_tab = []
         for i, line in enumerate(ref_tab):
@@ -619,37 +851,6 @@ class CreatingHtml:
         )
         ratio_df.to_csv(os.path.join(self.output_path, "ratio_word.csv"), index=True)
 
-    def count_word_in_match(self, text1, text2):
-        # Read the text of interest
-        with open(text1, "r") as file_text:
-            text_raw = file_text.read()
-
-        if text1 == text2:
-            return len(text_raw.split())
-
-        else:
-            list_match = self.getting_info(str(text1), str(text2), False)
-
-        if list_match:
-            # Copy text for placing beginning and end of match
-            char_text = []
-            for letter in text_raw:
-                char_text.append([letter, ""])
-
-            # Place the match
-            for match in list_match:
-                for intra_match in match[1]:
-                    for pos in range(intra_match[0], intra_match[1]):
-                        char_text[pos][1] = "I"
-
-            # Count the word in the match
-            wc = 0
-            for i, char in enumerate(char_text):
-                if char[0] == " " and char[1] == "I":
-                    wc += 1
-
-            return wc
-
 
 def main():
     """Takes arguments and run the program"""
@@ -669,7 +870,7 @@ def main():
         required=False,
         type=Path,
         default=None,
-        help="Folder of csv file where each word is associated with the id of its page (generated with sql_to_csv)",
+        help="Folder of the idpage files giving the page of each character of the volumes (generated with sql_to_csv, npz or csv of the previous format)",
     )
     parser.add_argument(
         "-r",
@@ -725,36 +926,67 @@ def main():
         "-t",
         "--threshold",
         required=False,
-        default=3,
+        default=[3],
+        nargs="+",
         type=int,
-        help="Value of the threshold for the text matcher",
+        help="Value of the threshold for the text matcher, several values start a sweep",
     )
     parser.add_argument(
         "-c",
         "--cutoff",
         required=False,
-        default=5,
+        default=[5],
+        nargs="+",
         type=int,
-        help="Value of the cutoff for the text matcher",
+        help="Value of the cutoff for the text matcher, several values start a sweep",
     )
     parser.add_argument(
         "-g",
         "--ngrams",
         required=False,
-        default=3,
+        default=[3],
+        nargs="+",
         type=int,
-        help="Value of the ngrams for the text matcher",
+        help="Value of the ngrams for the text matcher, several values start a sweep",
     )
     parser.add_argument(
         "-d",
         "--mindistance",
         required=False,
-        default=8,
+        default=[8],
+        nargs="+",
         type=int,
-        help="Value of the ngrams for the text matcher",
+        help="Value of the minDistance for the text matcher, several values start a sweep",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        required=False,
+        default=1,
+        type=int,
+        help="Number of processes used to apply the text matcher on the volumes",
+    )
+    parser.add_argument(
+        "--text-cache-size",
+        required=False,
+        default=512,
+        type=int,
+        help="Memory in MB used to keep the prepared texts between the matches (by process)",
+    )
+    parser.add_argument(
+        "--no-disk-cache",
+        help="Do not keep the prepared texts in ~/.cache/text-reuse between the runs",
+        required=False,
+        action="store_true",
     )
 
     args = vars(parser.parse_args())
+    parameters = [
+        args["threshold"],
+        args["cutoff"],
+        args["ngrams"],
+        args["mindistance"],
+    ]
 
     creation = CreatingHtml(
         PurePosixPath(args["input_volumes"]).as_posix(),
@@ -763,15 +995,22 @@ def main():
         str(args["metadata_heurist"]),
         PurePosixPath(args["output_html"]),
         args["normalize"],
-        args["threshold"],
-        args["cutoff"],
-        args["ngrams"],
-        args["mindistance"],
+        args["threshold"][0],
+        args["cutoff"][0],
+        args["ngrams"][0],
+        args["mindistance"][0],
         args["match_merger"],
         args["extended_match"],
+        args["workers"],
+        args["text_cache_size"],
+        not args["no_disk_cache"],
     )
 
-    creation.create_html()
+    # Several values for a parameter start a sweep over all the combinations
+    if any(len(values) > 1 for values in parameters):
+        creation.sweep(*parameters)
+    else:
+        creation.create_html()
 
     if args["input_volumes"] == args["input_references"]:
         creation.ref_on_ref()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+from horae_arkindex.client import ConcurrentClient, parse_rate_limits
+
+
+class StubError(Exception):
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+class StubClient:
+    """Client answering from a list of status by operation, 200 once it is empty"""
+
+    def __init__(self, status):
+        self.status = status
+        self.calls = []
+
+    def request(self, operation, **kwargs):
+        self.calls.append((operation, threading.get_ident()))
+        status = self.status.get(operation) or [200]
+        if status[0] != 200:
+            raise StubError(status.pop(0))
+        return {"id": kwargs.get("id")}
+
+    def paginate(self, operation, **kwargs):
+        yield self.request(operation, **kwargs)
+
+
+def test_retries():
+    stub = StubClient({"ListTranscriptions": [503, 429], "CreateElement": [400]})
+    with ConcurrentClient(lambda: stub, backoff=0) as client:
+        assert client.paginate("ListTranscriptions", id="page") == [{"id": "page"}]
+        assert len(stub.calls) == 3
+
+        # A client error is not retried
+        with pytest.raises(StubError):
+            client.request("CreateElement", body={})
+        assert len(stub.calls) == 4
+
+    stub = StubClient({"CreateElement": [503, 503, 503]})
+    with ConcurrentClient(lambda: stub, retries=2, backoff=0) as client:
+        with pytest.raises(StubError):
+            client.request("CreateElement", body={})
+        assert len(stub.calls) == 3
+
+
+def test_concurrent_requests():
+    clients = []
+
+    def make_client():
+        clients.append(StubClient({}))
+        return clients[-1]
+
+    with ConcurrentClient(make_client, workers=4) as client:
+        results = client.map(
+            lambda page_id: client.request("CreateTranscription", id=page_id),
+            range(20),
+        )
+    assert results == [{"id": page_id} for page_id in range(20)]
+    # One client by thread of the pool
+    assert 1 <= len(clients) <= 4
+    assert sum(len(stub.calls) for stub in clients) == 20
+    for stub in clients:
+        assert len({thread for _, thread in stub.calls}) == 1
+
+
+def test_rate_limits():
+    assert parse_rate_limits(["10", "CreateElement=2.5"]) == {
+        None: 10,
+        "CreateElement": 2.5,
+    }
+
+    stub = StubClient({})
+    with ConcurrentClient(lambda: stub, rate_limits={"CreateElement": 20}) as client:
+        start = time.monotonic()
+        client.map(lambda _: client.request("CreateElement"), range(5))
+        # The calls are spaced by 1/20s, the first one without waiting
+        assert time.monotonic() - start >= 0.2
+        start = time.monotonic()
+        client.request("ListElements")
+        assert time.monotonic() - start < 0.05
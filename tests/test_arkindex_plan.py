@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import io
+
+import pytest
+from horae_arkindex.client import ConcurrentClient
+from horae_arkindex.journal import Journal
+from horae_arkindex.plan import Plan, ml_class_key
+
+
+class StubError(Exception):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class StubClient:
+    """Client creating the elements of its operations, without bulk endpoints if bulk is False"""
+
+    def __init__(self, bulk):
+        self.bulk = bulk
+        self.calls = []
+        self.failing = set()
+
+    def lookup_operation(self, operation):
+        if not self.bulk and operation in ("CreateElements", "CreateClassifications"):
+            raise ValueError(operation)
+
+    def request(self, operation, **kwargs):
+        self.calls.append((operation, kwargs))
+        if operation in self.failing:
+            raise StubError(400)
+        if operation == "CreateElements":
+            return [
+                {"id": f"{kwargs['id']}/{element['name']}"}
+                for element in kwargs["body"]["elements"]
+            ]
+        if operation == "CreateElement":
+            return {"id": f"{kwargs['body']['parent']}/{kwargs['body']['name']}"}
+        if operation == "CreateTranscription":
+            return {"id": f"{kwargs['id']}/transcription"}
+        return {}
+
+
+@pytest.fixture
+def plan():
+    plan = Plan("corpus")
+    plan.add_classification("line1", "psalm")
+    plan.add_classification("line1", "beginning")
+    plan.add_classification("line1", "psalm")
+    plan.add_text_segment("page1", "Psalm 1", [[0, 0], [1, 1]], "psalm")
+    plan.add_text_segment("page1", "Psalm 2", [[1, 1], [2, 2]], "psalm")
+    plan.add_transcription_entity("transcription1", "entity", 0, 12)
+    plan.add_transcription_entity("transcription1", "entity", 0, 12)
+    return plan
+
+
+def test_plan(plan):
+    assert len(plan) == 7
+
+    stub = StubClient(bulk=False)
+    with ConcurrentClient(lambda: stub) as client:
+        assert plan.apply(client) == 0
+    operations = [operation for operation, _ in stub.calls]
+    assert operations.count("CreateElement") == 2
+    assert operations.count("CreateTranscriptionEntity") == 1
+    assert sorted(
+        (kwargs["body"]["element"], kwargs["body"]["ml_class"])
+        for operation, kwargs in stub.calls
+        if operation == "CreateClassification"
+    ) == [
+        ("line1", "beginning"),
+        ("line1", "psalm"),
+        ("page1/Psalm 1", "psalm"),
+        ("page1/Psalm 2", "psalm"),
+    ]
+
+
+def test_plan_bulk(plan):
+    stub = StubClient(bulk=True)
+    with ConcurrentClient(lambda: stub) as client:
+        assert plan.apply(client, worker_run_id="run") == 0
+    # One request for the segments of the page, one for the classes of each element
+    assert [
+        (operation, kwargs.get("id"), kwargs["body"])
+        for operation, kwargs in stub.calls
+        if operation == "CreateElements"
+    ] == [
+        (
+            "CreateElements",
+            "page1",
+            {
+                "worker_run_id": "run",
+                "elements": [
+                    {
+                        "type": "text_segment",
+                        "name": "Psalm 1",
+                        "polygon": [[0, 0], [1, 1]],
+                    },
+                    {
+                        "type": "text_segment",
+                        "name": "Psalm 2",
+                        "polygon": [[1, 1], [2, 2]],
+                    },
+                ],
+            },
+        )
+    ]
+    assert sorted(
+        (kwargs["body"]["parent"], kwargs["body"])
+        for operation, kwargs in stub.calls
+        if operation == "CreateClassifications"
+    ) == [
+        (
+            element_id,
+            {
+                "parent": element_id,
+                "worker_run_id": "run",
+                "classifications": [
+                    {"ml_class": ml_class, "confidence": 1.0} for ml_class in ml_classes
+                ],
+            },
+        )
+        for element_id, ml_classes in (
+            ("line1", ["psalm", "beginning"]),
+            ("page1/Psalm 1", ["psalm"]),
+            ("page1/Psalm 2", ["psalm"]),
+        )
+    ]
+
+
+def test_plan_bulk_fallback(plan):
+    # Without worker run, the bulk endpoints of the server are not used
+    stub = StubClient(bulk=True)
+    with ConcurrentClient(lambda: stub) as client:
+        assert plan.apply(client) == 0
+    operations = [operation for operation, _ in stub.calls]
+    assert "CreateElements" not in operations
+    assert "CreateClassifications" not in operations
+    assert operations.count("CreateElement") == 2
+    assert operations.count("CreateClassification") == 4
+
+    # The items of a rejected bulk request are sent one by one
+    stub = StubClient(bulk=True)
+    stub.failing.add("CreateElements")
+    with ConcurrentClient(lambda: stub) as client:
+        assert plan.apply(client, worker_run_id="run") == 0
+    operations = [operation for operation, _ in stub.calls]
+    assert operations.count("CreateElements") == 1
+    assert operations.count("CreateElement") == 2
+    assert operations.count("CreateClassifications") == 3
+
+
+def test_plan_file():
+    plan = Plan("corpus")
+    transcription = plan.add_transcription("page1", "Beatus uir\n")
+    plan.add_transcription_entity(transcription, "entity", 0, 10)
+    plan.add_text_segment("page1", "Psalm 1", [[0, 0], [1, 1]], ml_class_key("psalm"))
+    plan.add_classification("line1", ml_class_key("unknown"))
+
+    plan_file = io.StringIO()
+    plan.write(plan_file, "volume1")
+    plan.write(plan_file, "volume2")
+    plan_file.seek(0)
+    plans = list(Plan.read(plan_file, "corpus"))
+    assert [volume_id for volume_id, _ in plans] == ["volume1", "volume2"]
+    assert list(plans[0][1].operations()) == list(plan.operations())
+
+    stub = StubClient(bulk=False)
+    with ConcurrentClient(lambda: stub) as client:
+        # The class without id is not sent
+        assert plans[0][1].apply(client, {ml_class_key("psalm"): "psalm"}) == 1
+    assert [
+        (operation, kwargs.get("id"), kwargs["body"])
+        for operation, kwargs in stub.calls
+    ][1:] == [
+        (
+            "CreateElement",
+            None,
+            {
+                "type": "text_segment",
+                "name": "Psalm 1",
+                "corpus": "corpus",
+                "parent": "page1",
+                "polygon": [[0, 0], [1, 1]],
+            },
+        ),
+        (
+            "CreateClassification",
+            None,
+            {"element": "page1/Psalm 1", "ml_class": "psalm"},
+        ),
+        (
+            "CreateTranscriptionEntity",
+            "page1/transcription",
+            {"entity": "entity", "offset": 0, "length": 10},
+        ),
+    ]
+
+
+def test_journal(tmp_path, plan):
+    stub = StubClient(bulk=False)
+    stub.failing.add("CreateClassification")
+    with ConcurrentClient(lambda: stub) as client, Journal(
+        tmp_path / "journal.sqlite"
+    ) as journal:
+        assert plan.apply(client, journal=journal.start("volume")) == 4
+        assert not journal.is_done("volume")
+
+    # The next run only sends the requests which failed, to the segments already created
+    stub = StubClient(bulk=False)
+    with ConcurrentClient(lambda: stub) as client, Journal(
+        tmp_path / "journal.sqlite"
+    ) as journal:
+        volume_journal = journal.start("volume")
+        assert len(volume_journal.sent) == 3
+        assert plan.apply(client, journal=volume_journal) == 0
+        journal.finish("volume")
+        assert journal.is_done("volume")
+    assert sorted(
+        (operation, kwargs["body"]["element"]) for operation, kwargs in stub.calls
+    ) == [
+        ("CreateClassification", "line1"),
+        ("CreateClassification", "line1"),
+        ("CreateClassification", "page1/Psalm 1"),
+        ("CreateClassification", "page1/Psalm 2"),
+    ]
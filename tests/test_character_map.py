@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from horae_arkindex.character_map import CharacterMap
+
+
+def test_character_map():
+    character_map = CharacterMap()
+    character_map.add_line("page1", [[0, 0], [1, 1]], "line1", 3, 0)
+    character_map.add_line("page1", [[1, 1], [2, 2]], "line2", 2, 3)
+    character_map.add_line("page2", [[2, 2], [3, 3]], "line3", 1, 0)
+
+    # Each line is followed by a space
+    assert len(character_map) == 9
+    assert character_map.line_indexes.tolist() == [0, 0, 0, 0, 1, 1, 1, 2, 2]
+    assert character_map.offsets.tolist() == [0, 1, 2, 4, 3, 4, 6, 0, 2]
+    assert [character_map.page_id(position) for position in (0, 6, 7)] == [
+        "page1",
+        "page1",
+        "page2",
+    ]
+    assert character_map.offset(5) == 4
+    assert character_map.polygon(4) == [[1, 1], [2, 2]]
+    assert character_map.line_id(-1) == "line3"
+
+    # The ranges are views of the characters
+    line_indexes = character_map.line_indexes[2:8]
+    assert np.shares_memory(line_indexes, character_map.line_indexes)
+    assert character_map.pages(line_indexes).tolist() == [0, 0, 0, 0, 0, 1]
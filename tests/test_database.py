@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+from horae_sql import database as db_module
+from horae_sql.database import INDEXES, Database, prepare_database
+from horae_sql.volume_loader import VOLUME_QUERIES
+
+
+@pytest.fixture
+def dump(tmp_path):
+    path = tmp_path / "dump's.sqlite"
+    db = sqlite3.connect(path)
+    db.executescript(
+        """
+        create table element (id text primary key, name text, type text, polygon text);
+        create table element_path (parent_id text, child_id text, ordering integer, unique (parent_id, child_id));
+        create table transcription (element_id text, text text);
+        create table metadata (element_id text, name text, value text);
+        """
+    )
+    db.close()
+    return path
+
+
+def test_named_queries(dump):
+    db = sqlite3.connect(dump)
+    db.executescript(
+        """
+        insert into element values ('vol''1', 'volume', 'volume', null);
+        insert into element values ('page', '1', 'page', null);
+        insert into element_path values ('vol''1', 'page', 0);
+        """
+    )
+    db.commit()
+    db.close()
+
+    with Database(dump) as database:
+        assert database.fetchall("volumes") == [("vol'1",)]
+        assert database.fetchone("pages", ("vol'1",)) == ("page", 0)
+        assert database.fetchall("volumes_pages", ids=["vol'1", "other"]) == [
+            ("vol'1", "page", 0)
+        ]
+        assert database.counts == {"volumes": 1, "pages": 1, "volumes_pages": 1}
+
+        # The dump is opened in read-only mode
+        with pytest.raises(sqlite3.OperationalError):
+            database.connection.execute("delete from element;")
+
+
+def test_segment_names(dump):
+    db = sqlite3.connect(dump)
+    db.executescript(
+        """
+        insert into element values ('seg1', 'Psalm 1 h1', 'text_segment', null);
+        insert into element values ('seg2', 'Psalm 1 h1', 'text_segment', null);
+        insert into element values ('seg3', 'Hymn 2 h2', 'text_segment', null);
+        insert into element_path values ('vol', 'page', 0);
+        insert into element_path values ('page', 'seg1', 0);
+        insert into element_path values ('page', 'seg2', 1);
+        insert into element_path values ('page', 'seg3', 2);
+        """
+    )
+    db.commit()
+    db.close()
+
+    # More volumes than the ids bound in a query
+    ids = [f"other{i}" for i in range(db_module.MAX_IDS_BY_QUERY)] + ["vol"]
+    with Database(dump) as database:
+        assert database.fetchall_by_ids("volumes_segment_names", ("%psalm%",), ids) == [
+            ("vol", "Psalm 1 h1")
+        ]
+        assert database.counts == {"volumes_segment_names": 2}
+
+
+def test_prepare_database(dump):
+    queries = [(name, (), ["vol'1"]) for name in VOLUME_QUERIES]
+    with Database(dump, read_only=False) as database:
+        assert database.explain(queries) == [
+            "volumes_transcriptions",
+            "volumes_digitization_type",
+        ]
+
+        statements = prepare_database(database.connection)
+        # The unique constraint already indexes element_path.parent_id
+        assert len(statements) == len(INDEXES)
+        assert statements[-1] == "analyze;"
+        assert database.explain(queries) == []
+        assert database.connection.execute(
+            "select statement from text_reuse_prepare"
+        ).fetchall() == [(statement,) for statement in statements]
+
+        # Nothing is missing the second time
+        assert prepare_database(database.connection) == ["analyze;"]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import os
+
+from horae_reference_texts.metadata import HeuristMetadata
+
+FIXTURES = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "data",
+)
+
+
+def test_lookups():
+    metadata = HeuristMetadata(os.path.join(FIXTURES, "metadata_heurist.csv"))
+    text = metadata.by_id["c22be02f-e6be-4cd7-8025-a46345b307f3"]
+    assert text.name == " Psalm 41 "
+    assert text.h_tag == "h1005"
+    assert text.short_name == "Psalm 41 | Psalm | h1005"
+    assert (
+        metadata.by_tag["h1006"].arkindex_id == "d7825d17-beff-4c62-9f8d-dd36f0a968fd"
+    )
+    assert len(metadata) == len(metadata.by_tag)
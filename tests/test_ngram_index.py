@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from horae_text_matcher.ngram_index import NgramIndex, folder_signature
+from horae_text_matcher.similarity import count_words_in_spans
+from nltk.util import ngrams
+
+
+class Tokens:
+    """Minimal replacement of the text object of text_matcher"""
+
+    def __init__(self, text):
+        self.tokens = text.split()
+
+    def ngrams(self, n):
+        return list(ngrams(self.tokens, n))
+
+
+def test_candidates():
+    index = NgramIndex(3)
+    index.add("psalm_a", Tokens("dixit dominus domino meo sede a dextris meis"))
+    index.add("psalm_b", Tokens("laudate pueri dominum laudate nomen domini"))
+
+    volume = Tokens("incipit dixit dominus domino meo sede a dextris alleluia")
+    assert index.count_shared(volume) == {0: 5}
+    assert index.candidates(volume, 3) == {"psalm_a"}
+    assert index.candidates(volume, 6) == set()
+
+
+def test_save_and_load(tmp_path):
+    reference = tmp_path / "ref.txt"
+    reference.write_text("dixit dominus domino meo")
+    signature = folder_signature(str(tmp_path), [str(reference)], 3, True)
+
+    index = NgramIndex(3, signature)
+    index.add("ref.txt", Tokens(reference.read_text()))
+    index_path = str(tmp_path / "cache" / "index.pickle")
+    index.save(index_path)
+
+    loaded = NgramIndex.load(index_path, signature)
+    assert loaded.references == ["ref.txt"]
+    assert loaded.postings == index.postings
+
+    # The index is outdated when the reference changes
+    reference.write_text("dixit dominus domino meo sede")
+    new_signature = folder_signature(str(tmp_path), [str(reference)], 3, True)
+    assert NgramIndex.load(index_path, new_signature) is None
+
+
+def test_count_words_in_spans():
+    text = "dixit dominus domino meo sede a dextris meis "
+    spaces = [pos for pos, letter in enumerate(text) if letter == " "]
+    # The overlapping spans only count once
+    assert count_words_in_spans(spaces, [(6, 20), (14, 24)]) == 2
+    assert count_words_in_spans(spaces, [(0, 5), (40, 45)]) == 1
+    assert count_words_in_spans(spaces, []) == 0
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import csv
+
+import pytest
+from horae_sql.page_map import PageMap
+
+
+def test_page_map(tmp_path):
+    page_map = PageMap.from_pages([("p1", 3), ("empty", 0), ("p2", 2), ("p3", 1)])
+    assert len(page_map) == 6
+    assert [page_map.page(position) for position in range(6)] == [
+        "p1",
+        "p1",
+        "p1",
+        "p2",
+        "p2",
+        "p3",
+    ]
+    with pytest.raises(IndexError):
+        page_map.page(6)
+
+    page_map.save(tmp_path / "idpage_volume.npz")
+    loaded = PageMap.load(tmp_path / "idpage_volume.npz")
+    assert (loaded.starts, loaded.page_ids, len(loaded)) == (
+        [0, 3, 5],
+        ["p1", "p2", "p3"],
+        6,
+    )
+
+
+def test_previous_format(tmp_path):
+    # One row [letter, page_id] by character
+    with open(tmp_path / "idpage_volume.txt", "w", newline="") as link_file:
+        csv.writer(link_file).writerows(
+            [["a", "p1"], [",", "p1"], [" ", "p2"], ['"', "p2"], ["b", "p3"]]
+        )
+    page_map = PageMap.load(tmp_path / "idpage_volume.txt")
+    assert (page_map.starts, page_map.page_ids, len(page_map)) == (
+        [0, 2, 4],
+        ["p1", "p2", "p3"],
+        5,
+    )
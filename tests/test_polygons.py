@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from horae_sql import polygons
+from shapely.geometry import Polygon
+
+
+def test_parse_polygon():
+    expected = np.array([[0, 0], [10, 0], [10, 5], [0, 0]])
+    assert np.array_equal(
+        polygons.parse_polygon("[[0, 0], [10, 0], [10, 5], [0, 0]]"), expected
+    )
+    assert np.array_equal(
+        polygons.parse_polygon("((0, 0), (10, 0), (10, 5), (0, 0))"), expected
+    )
+    assert np.array_equal(
+        polygons.parse_polygon([[0, 0], [10, 0], [10, 5], [0, 0]]), expected
+    )
+
+
+def test_centroids_and_bounds():
+    rings = polygons.parse_polygons(
+        [
+            # Closed and not closed rings
+            "[[1000, 2000], [1300, 2000], [1300, 2050], [1000, 2050], [1000, 2000]]",
+            "[[0, 0], [40, 10], [20, 50], [5, 30]]",
+            # Without area
+            "[[5, 5], [10, 10], [15, 15], [5, 5]]",
+        ]
+    )
+    expected = [Polygon(ring) for ring in rings]
+    assert np.allclose(
+        polygons.polygon_centroids(rings),
+        [(shape.centroid.x, shape.centroid.y) for shape in expected],
+    )
+    assert np.array_equal(
+        polygons.polygon_bounds(rings), [shape.bounds for shape in expected]
+    )
+    assert polygons.polygon_centroids([]).shape == (0, 2)
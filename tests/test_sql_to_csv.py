@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import os
+import sqlite3
 
 import pandas as pd
-from sql_to_csv.sql_to_csv import SqlToCsv
+import pytest
+from sql_to_csv.sql_to_csv import SqlToCsv, open_atomic
 
 FIXTURES = os.path.join(
     os.path.dirname(os.path.realpath(__file__)),
@@ -28,3 +30,85 @@ def test_text_from_elements():
     # the data to assert
     double_expected_text = "me pries luy que il vueille me pries luy que il vueille egesimo octavoir mon cuer calum egesimo octavoir mon cuer calum servir et amer servir et amer Ave maria Ave maria Eratres doulce dame pour Eratres doulce dame pour Arcelle grant ioie que Arcelle grant ioie que vous eustes au iour de nost vous eustes au iour de nost quant prae doule filia nascum quant prae doule filia nascum de populus Doulce dame pries de populus Doulce dame pries luy que il mortiorem habens luy que il mortiorem habens Mitte natuite ama redemptio Mitte natuite ama redemptio Ave maria Ave maria Patres doulce dame post Patres doulce dame post Sur icelle grant ioitum Sur icelle grant ioitum que vous eustes quant vos que vous eustes quant vos trigis robis viderent ostris trigis robis viderent ostris a vostre doule fili cor muliere a vostre doule fili cor muliere et encens et il les receut et encens et il les receut Doulce dame pries luper quae Doulce dame pries luper quae il vueille recesservoir mam il vueille recesservoir mam quant elephara Domini quant elephara Domini corpus corpus Lae maria Lae maria Et tres doulce dame per Et tres doulce dame per Assur icelle grant more Assur icelle grant more que vous eustes quant vos que vous eustes quant vos Christus in templum Christus in templum invenirent curribus invenirent curribus "
     assert double_expected_text == double_text
+
+
+def test_line_functions():
+    lines = [[(0, y), (100, y), (100, y + 10), (0, y + 10)] for y in range(0, 50, 10)]
+    segments = [
+        [(0, 0), (100, 0), (100, 15), (0, 15)],
+        [(0, 15), (100, 15), (100, 35), (0, 35)],
+    ]
+    names = ["Psalm 1 h1", "Psalm 2 h2"]
+    # The last segment intersecting a line gives its function
+    functions = SqlToCsv.get_line_functions(lines, segments, names)
+    assert list(functions) == ["h1", "h2", "h2", "h2", ""]
+    assert list(SqlToCsv.get_line_functions(lines, [], [])) == [""] * 5
+
+    # The bounding boxes intersect but not the polygons
+    square = [(0, 0), (10, 0), (10, 10), (0, 10)]
+    triangle = [(20, 20), (20, 5), (5, 20)]
+    assert list(SqlToCsv.get_line_functions([square], [triangle], ["h3"])) == [""]
+
+
+def test_bio_tags():
+    df_volume = pd.DataFrame(
+        {
+            "function": ["none", "h1", "h1", "h1", "h2", "none", "h2"],
+            "text": ["a b", "c d", "", "e", "f g", "h", "i"],
+        }
+    )
+    # The line without text does not start a new text
+    assert SqlToCsv.get_bio_tags(df_volume) == [
+        ["a", "O"],
+        ["b", "O"],
+        ["c", "B-h1"],
+        ["d", "I-h1"],
+        ["e", "I-h1"],
+        ["f", "B-h2"],
+        ["g", "I-h2"],
+        ["h", "O"],
+        ["i", "B-h2"],
+    ]
+    assert SqlToCsv.get_bio_tags(df_volume[df_volume["text"] == ""]) == []
+
+
+def test_text_segment_complete(tmp_path):
+    path = tmp_path / "dump.sqlite"
+    db = sqlite3.connect(path)
+    db.executescript(
+        """
+        create table element (id text primary key, name text, type text, polygon text);
+        create table element_path (parent_id text, child_id text, ordering integer);
+        insert into element values ('seg1', 'Psalm 1 h1', 'text_segment', null);
+        insert into element values ('seg2', 'Psalm 2 h2', 'text_segment', null);
+        insert into element_path values ('vol1', 'page1', 0);
+        insert into element_path values ('page1', 'seg1', 0);
+        insert into element_path values ('page1', 'seg2', 1);
+        """
+    )
+    db.close()
+
+    with SqlToCsv(path, tmp_path) as export:
+        export.get_text_segment_complete("psalm", ["vol1", "vol2"], "segments.csv")
+        assert (tmp_path / "segments.csv").read_text() == ",h1,h2\nvol1,1,1\nvol2,0,0\n"
+
+        # Volumes without text segment
+        export.get_text_segment_complete("hymn", ["vol1", "vol2"], "segments.csv")
+        assert (tmp_path / "segments.csv").read_text() == '""\nvol1\nvol2\n'
+
+
+def test_open_atomic(tmp_path):
+    path = tmp_path / "line_volume.txt"
+    for _ in range(2):
+        with open_atomic(path) as file:
+            file.write("beatus vir ")
+    # Running the export again replaces the file
+    assert path.read_text() == "beatus vir "
+
+    # An interrupted export keeps the previous file
+    with pytest.raises(KeyboardInterrupt):
+        with open_atomic(path) as file:
+            file.write("domine")
+            raise KeyboardInterrupt
+    assert path.read_text() == "beatus vir "
+    assert os.listdir(tmp_path) == ["line_volume.txt"]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from pathlib import Path
+
+import numpy as np
+from horae_text_matcher.disk_cache import DiskTextCache, content_hash
+from horae_text_matcher.text_cache import TextCache, estimate_size
+
+
+class Tokens:
+    """Minimal replacement of the text object of text_matcher"""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = text.split()
+        self.spans = [(0, 0)] * len(self.tokens)
+
+
+def test_lru_eviction():
+    texts = {name: Tokens(f"{name} " * 100) for name in ["a", "b", "c"]}
+    cache = TextCache(2 * estimate_size(texts["a"]))
+
+    cache.put("a", texts["a"])
+    cache.put("b", texts["b"])
+    # Reading "a" makes "b" the least recently used text
+    assert cache.get("a") is texts["a"]
+    cache.put("c", texts["c"])
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") is texts["a"]
+    assert cache.get("c") is texts["c"]
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_key_changes_with_file(tmp_path):
+    path = tmp_path / "psalm.txt"
+    path.write_text("dixit dominus")
+    key = TextCache.key(str(path), True, 3)
+    assert TextCache.key(str(path), False, 3) != key
+    assert TextCache.key(str(path), True, 4) != key
+
+
+def test_disk_cache(tmp_path):
+    text = Tokens("dixit dominus domino meo sede a dextris meis")
+    text.spans = [(i, i + 1) for i in range(len(text.tokens))]
+    text.computed_hashes = {3: np.arange(6, dtype=np.uint64)}
+    cache = DiskTextCache(str(tmp_path))
+    digest = content_hash(text.text)
+    cache.save(digest, text)
+
+    loaded = cache.load(digest, "psalm")
+    assert loaded.text == text.text
+    assert loaded.label == "psalm"
+    assert loaded.tokens == text.tokens
+    assert loaded.spans == text.spans
+    assert loaded.computed_hashes[3].tolist() == list(range(6))
+
+    # A corrupted entry is removed
+    (Path(cache.entry_path(digest)) / "meta.json").write_text("{")
+    assert cache.load(digest, "psalm") is None
+    assert not Path(cache.entry_path(digest)).exists()
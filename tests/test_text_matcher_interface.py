@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import csv
+import importlib.util
+import os
+
+import pytest
+from horae_sql.page_map import PageMap
+
+# The interface is a script of the text-matcher folder, not a package
+spec = importlib.util.spec_from_file_location(
+    "text_matcher_interface",
+    os.path.join(
+        os.path.dirname(os.path.realpath(__file__)),
+        "..",
+        "src",
+        "text-matcher",
+        "text_matcher_interface.py",
+    ),
+)
+text_matcher_interface = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(text_matcher_interface)
+
+PAGES = [
+    ("page1", "Domine labia mea aperies et os meum annuntiabit laudem tuam. "),
+    (
+        "page2",
+        "Beatus uir qui non abiit in consilio impiorum et in uia peccatorum "
+        "non stetit et in cathedra pestilentie non sedit sed in lege domini "
+        "uoluntas eius et in lege eius meditabitur die ac nocte. ",
+    ),
+]
+
+
+@pytest.fixture
+def folders(tmp_path):
+    (tmp_path / "volumes").mkdir()
+    (tmp_path / "volumes" / "para_vol1.txt").write_text(
+        "".join(text for _, text in PAGES)
+    )
+    (tmp_path / "references").mkdir()
+    (tmp_path / "references" / "ref1.txt").write_text(PAGES[1][1])
+    with open(tmp_path / "metadata.csv", "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["ID Arkindex", "ID Annotation", "Work H-ID"])
+        writer.writerow(["ref1", "Beatus uir | HORAE | Psalm 1 | Psalm | h1", "1"])
+    (tmp_path / "output").mkdir()
+
+    # Page map of sql_to_csv and csv file of the previous format
+    (tmp_path / "npz").mkdir()
+    PageMap.from_pages([(page_id, len(text)) for page_id, text in PAGES]).save(
+        str(tmp_path / "npz" / "idpage_vol1.npz")
+    )
+    (tmp_path / "txt").mkdir()
+    with open(tmp_path / "txt" / "idpage_vol1.txt", "w", newline="") as file:
+        csv.writer(file).writerows(
+            [letter, page_id] for page_id, text in PAGES for letter in text
+        )
+    return tmp_path
+
+
+def order_ref(folders, link):
+    creation = text_matcher_interface.CreatingHtml(
+        folders / "volumes",
+        link,
+        folders / "references",
+        folders / "metadata.csv",
+        folders / "output",
+        normalize=False,
+        threshold=3,
+        cutoff=3,
+        ngrams=3,
+        mindistance=5,
+        match_merger=False,
+        extended_match=False,
+        disk_cache=False,
+    )
+    text = str(folders / "volumes" / "para_vol1.txt")
+    eval_df = creation.create_eval_df([text])
+    return creation.new_interface(text, str(folders / "references"), eval_df)[0]
+
+
+def test_link_files(folders):
+    # The page of the match is found with the npz page maps alone
+    links = order_ref(folders, folders / "npz")
+    assert links[1][1:] == [
+        os.path.join(text_matcher_interface.ARKINDEX_VOLUME_URL, "page2")
+    ]
+    assert order_ref(folders, folders / "txt") == links
+
+    # A volume without page map is an error
+    (folders / "empty").mkdir()
+    with pytest.raises(FileNotFoundError):
+        order_ref(folders, folders / "empty")
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+from horae_sql.database import Database
+from horae_sql.volume_loader import VolumeLoader
+
+
+def create_database(path):
+    db = sqlite3.connect(path)
+    db.executescript(
+        """
+        create table element (id text primary key, name text, type text, polygon text);
+        create table element_path (parent_id text, child_id text, ordering integer);
+        create table transcription (element_id text, text text);
+        create table metadata (element_id text, name text, value text);
+        insert into element values ('vol', 'volume', 'volume', null);
+        insert into element values ('p2', '2', 'page', null);
+        insert into element values ('p1', '1', 'page', null);
+        insert into element values ('l1', 'l1', 'text_line', '[[0, 0]]');
+        insert into element values ('l2', 'l2', 'text_line', '[[0, 10]]');
+        insert into element values ('s1', 's1', 'text_segment', '[[0, 0]]');
+        insert into element_path values ('vol', 'p2', 1);
+        insert into element_path values ('vol', 'p1', 0);
+        insert into element_path values ('p1', 'l2', 0);
+        insert into element_path values ('p1', 'l1', 1);
+        insert into element_path values ('p2', 's1', 0);
+        insert into transcription values ('l2', 'beatus vir');
+        insert into transcription values ('l1', 'domine');
+        insert into metadata values ('vol', 'Digitization Type', 'complete');
+        """
+    )
+    db.commit()
+    db.close()
+
+
+def test_load_volume(tmp_path):
+    create_database(tmp_path / "dump.sqlite")
+    with Database(tmp_path / "dump.sqlite") as database:
+        volumes = VolumeLoader(database).load()
+        assert database.counts["volumes_pages"] == 1
+    assert list(volumes) == ["vol"]
+
+    volume = volumes["vol"]
+    assert volume.digitization_type == "complete"
+    assert volume.pages == [("p1", 0), ("p2", 1)]
+    assert [element[0] for element in volume.elements("p1", "text_line")] == [
+        "l1",
+        "l2",
+    ]
+    assert volume.elements("p2", "text_line") == []
+    assert volume.elements("p2", "text_segment") == [("s1", "s1", "[[0, 0]]")]
+    assert volume.texts("l2") == ["beatus vir"]
+    assert volume.texts("s1") == []